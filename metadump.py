@@ -9,11 +9,182 @@ from __future__ import print_function
 # internal Python modules
 import os
 import sys
-import json
 import argparse
+import multiprocessing
+import collections
+try:
+    from concurrent import futures
+except ImportError:
+    # Python 2.x without the backport - the files are scanned in the main
+    # process, see main()
+    futures = None
+try:
+    from os import scandir
+except ImportError:
+    # Python 2.x - try the 'scandir' backport, see _iter_files()
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 #
 from pymdeco.services import FileMetadataService
-from pymdeco.exceptions import GeneralException
+from pymdeco.scanners import FileInfoScanner
+from pymdeco.utils import FileHashCache, EnhancedDict
+from pymdeco.exceptions import GeneralException, MissingDependencyException
+
+
+# scan service of the current process; created once per (worker) process
+_scan_service = None
+# set by main() and passed to the worker processes
+_use_hash_cache = True
+
+
+def _get_scan_service():
+    global _scan_service
+    if _scan_service is None:
+        _scan_service = FileMetadataService() # use the defaults
+        if _use_hash_cache:
+            _enable_hash_cache(_scan_service)
+    return _scan_service
+
+
+def _enable_hash_cache(scan_service):
+    """
+    Makes the scanners of the service use the persistent checksum cache (if
+    the 'lmdb' library is installed).
+    """
+    try:
+        hash_cache = FileHashCache()
+    except MissingDependencyException:
+        return
+    for scanner in scan_service.available_scanners().values():
+        if isinstance(scanner, FileInfoScanner):
+            scanner.hash_cache = hash_cache
+
+
+def _iter_files(root_path):
+    """
+    Yields tuples (path, stat result) for all files under *root_path* in the
+    same order as :func:`os.walk` does. The stat result is None if the file
+    cannot be stat-ed (i.e. broken symbolic links).
+    """
+    if scandir is None:
+        for item in _iter_files_walk(root_path):
+            yield item
+        return
+
+    try:
+        entries = list(scandir(root_path))
+    except OSError:
+        # same as os.walk() - ignore the directories that cannot be listed
+        return
+
+    subdirs = []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            # symbolic links to directories are not followed (as in os.walk)
+            if not entry.is_symlink():
+                subdirs.append(entry.path)
+            continue
+
+        try:
+            fstat = entry.stat()
+        except OSError:
+            fstat = None
+        yield (entry.path, fstat)
+
+    for subdir in subdirs:
+        for item in _iter_files(subdir):
+            yield item
+
+
+def _iter_files_walk(root_path):
+    # the same as _iter_files(), but for Python without os.scandir()
+    for root, dirs, files in os.walk(root_path):
+        for fname in files:
+            fpath = os.path.join(root, fname)
+            try:
+                fstat = os.stat(fpath)
+            except OSError:
+                fstat = None
+            yield (fpath, fstat)
+
+
+def _to_json(finfo):
+    """
+    Converts the metadata to indented JSON (with orjson if it is installed,
+    see :meth:`EnhancedDict.to_json`).
+    """
+    if not isinstance(finfo, EnhancedDict):
+        finfo = EnhancedDict(finfo)
+    return finfo.to_json(ensure_ascii=False, indent=2)
+
+
+def _scan_one(item):
+    """
+    Extracts the metadata of a single file from the tuple (path, stat result)
+    *item*. Returns a tuple (path, metadata, error message) where either the
+    metadata or the error message is None.
+    """
+    fpath, fstat = item
+    try:
+        finfo = _get_scan_service().get_metadata(fpath, pre_stat=fstat)
+    except GeneralException as ex:
+        return (fpath, None, str(ex))
+    return (fpath, finfo, None)
+
+
+def _scan_one_chunk(items, use_hash_cache):
+    # the worker processes are not always forked from main() (i.e. on
+    # Windows), so the option is passed along with the files
+    global _use_hash_cache
+    _use_hash_cache = use_hash_cache
+    return [_scan_one(item) for item in items]
+
+
+def _iter_chunks(iterable, size):
+    """
+    Yields lists with up to *size* consecutive items of *iterable*.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _scan_parallel(executor, files, window, chunk_size=16):
+    """
+    Yields the results of :func:`_scan_one` for all *files* (in the same
+    order), scanned by the worker processes of *executor*.
+
+    The files are sent to the workers in chunks of *chunk_size* and at most
+    *window* chunks are queued at any time, so the results are available
+    while the directory tree is still being walked. The queued chunks are
+    cancelled when the generator is closed before the end (i.e. on error
+    or when interrupted by the user).
+    """
+    pending = collections.deque()
+    try:
+        for chunk in _iter_chunks(files, chunk_size):
+            pending.append(executor.submit(_scan_one_chunk, chunk,
+                                           _use_hash_cache))
+            if len(pending) >= window:
+                for result in pending.popleft().result():
+                    yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
 
 
 def main(arg=None):
@@ -37,25 +208,54 @@ def main(arg=None):
         help='Starting point (directory path)'
         )
 
+    parser.add_argument(
+        '-j','--jobs',
+        action='store',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='Number of files scanned in parallel (default: number of CPUs)'
+        )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not use (or update) the persistent cache of file checksums'
+        )
+
     if arg is None:
         arguments = parser.parse_args()
     else:
         arguments = parser.parse_args(arg)
 
+    global _use_hash_cache
+    _use_hash_cache = not arguments.no_cache
+
     root_path = arguments.path
-    scan_service = FileMetadataService() # use the defaults
+    # created here to report missing dependencies before scanning starts;
+    # forked worker processes inherit it
+    _get_scan_service()
 
-#    print("Services:", scan_service.available_scanners())
-    for root, dirs, files in os.walk(root_path):
-        for afile in files:
-            fpath = os.path.join(root, afile)
+    files = _iter_files(root_path)
+    if arguments.jobs > 1 and futures is not None:
+        executor = futures.ProcessPoolExecutor(max_workers=arguments.jobs)
+        results = _scan_parallel(executor, files, window=2 * arguments.jobs)
+    else:
+        executor = None
+        results = (_scan_one(item) for item in files)
+
+    try:
+        for fpath, finfo, error in results:
             print ("processing file:", fpath)
-            try:
-                finfo = scan_service.get_metadata(fpath)
-            except GeneralException as ex:
-                print("ERROR: Exception occured:\n" + str(ex))
-            meta_json = json.dumps(finfo, ensure_ascii=False, indent=2)
+            if error is not None:
+                print("ERROR: Exception occured:\n" + error)
+                continue
+            meta_json = _to_json(finfo)
             print ("Meta data (JSON):\n", meta_json)
+    finally:
+        # cancels the scans that have not started yet (if any)
+        results.close()
+        if executor is not None:
+            executor.shutdown()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# cython: language_level=3
+#
+# Author: Todor Bukov
+# License: LGPL version 3.0 - see LICENSE.txt for details
+#
+"""
+Optional compiled versions of the tree dictionary helpers in
+:mod:`pymdeco.utils`. The module is built by setup.py when Cython is
+installed and is used automatically if present; otherwise the pure Python
+implementations are used instead.
+"""
+
+cdef object _MISSING = object()
+
+
+def iter_tree_leaves(parentkey, subdict, sep):
+    """
+    Yields the (flat key, value) pairs for all leaves of *subdict*, whose
+    keys are prefixed with *parentkey* (unless it is None).
+    """
+    cdef unicode strkey
+    cdef unicode newkey
+    for key, element in subdict.items():
+        strkey = key if isinstance(key, unicode) else unicode(key)
+        newkey = strkey if parentkey is None else parentkey + sep + strkey
+        if isinstance(element, dict):
+            for leaf in iter_tree_leaves(newkey, element, sep):
+                yield leaf
+        else:
+            yield newkey, element
+
+
+cpdef object get_tree_branch(object root, list split_keys):
+    """
+    Returns the nested dictionary of *root* found by following the list of
+    keys *split_keys*, creating the missing branches along the way.
+    """
+    cdef object current_dict = root
+    cdef object sub_element
+    for key in split_keys:
+        sub_element = current_dict.get(key, _MISSING)
+        if sub_element is _MISSING:
+            sub_element = {}
+            current_dict[key] = sub_element
+        elif not isinstance(sub_element, dict):
+            # the same as in the pure Python version - the existing leaf
+            # becomes a key (with value None) of the new branch
+            sub_element = {sub_element : None}
+            current_dict[key] = sub_element
+        current_dict = sub_element
+    return current_dict
@@ -42,18 +42,21 @@ For these reasons it is recommended to use higher-level classes included in
 from __future__ import print_function
 # internal Python modules
 import os
-import sys
 import json
 import subprocess
 import numbers
-import mimetypes
 
 # package imports
-from pymdeco.utils import EnhancedDict, escape_file_name
-from pymdeco.exceptions import GeneralException
+from pymdeco.utils import EnhancedDict, guess_mime_by_ext
+from pymdeco.exceptions import GeneralException, MissingDependencyException
 
 # external modules - must be installed separately
-import pyexiv2
+try:
+    import pyexiv2
+except ImportError:
+    # get_image_metadata() is not available; the rest of the module (and
+    # the scanners not related to images) still work
+    pyexiv2 = None
 
 
 def get_image_metadata(fpath, fractions_as_float=False):
@@ -61,7 +64,11 @@ def get_image_metadata(fpath, fractions_as_float=False):
     Uses `exiv2 <http://exiv2.org/>`_  and its Python
     bindings `pyxeiv2 <http://tilloy.net/dev/pyexiv2/>`_ library to extract
     the metadata from an image and return it as a dictionary.
+    Raises :exc:`MissingDependencyException` if pyexiv2 is not installed.
     """
+    if pyexiv2 is None:
+        raise MissingDependencyException("pyexiv2 library not installed!")
+
     metadata = pyexiv2.ImageMetadata(fpath)
     metadata.read()
     result = EnhancedDict()
@@ -146,29 +153,24 @@ def get_multimedia_metadata(file_path, ffprobe_path):
         errmsg = "Cannot find 'ffprobe' at: " + str(ffprobe_path)
         raise GeneralException(errmsg)
 
-    # work around the issue with invoking the executable under Windows/Linux
-    # Linux - shell must be True otherwise Popen can't find the file
-    # Windows - shell must be False to avoid unnecessary invoking the command
-    # shell
-    use_shell = True
-    if sys.platform.startswith('win'):
-        use_shell = False
-
-    escaped_fpath = escape_file_name(file_path)
+    # the arguments are passed directly to ffprobe (without shell), so the
+    # file name does not need any escaping
     ffprobe_pipe = subprocess.Popen(
-        " ".join([ffprobe_path,
-                  '-print_format json',
-                  '-show_format',
-                  '-show_streams',
-                  escaped_fpath]),
+        [ffprobe_path,
+         '-print_format', 'json',
+         '-show_format',
+         '-show_streams',
+         file_path],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=use_shell
+        stderr=subprocess.PIPE
     )
     
-    ffprobe_output = ffprobe_pipe.stdout.readlines()
-    ffprobe_err = ffprobe_pipe.stderr.readlines()
+    # communicate() reads both pipes at once, so ffprobe cannot block on a
+    # full stderr pipe while its stdout is being read
+    ffprobe_output, ffprobe_err = ffprobe_pipe.communicate()
+    ffprobe_output = ffprobe_output.decode('utf-8', 'replace').splitlines(True)
+    ffprobe_err = ffprobe_err.decode('utf-8', 'replace').splitlines(True)
     
     if ffprobe_output == []:
         err_msg = "".join(ffprobe_err)
@@ -197,5 +199,5 @@ def guess_file_mime(fpath):
    TODO: may enhance it in the future to use "magic numbers" or
    file content inspection to determine the correct MIME type.
     """
-    mime_type = mimetypes.guess_type(fpath)[0]
+    mime_type = guess_mime_by_ext(fpath)
     return mime_type
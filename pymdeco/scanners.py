@@ -79,17 +79,45 @@ Example usage (the output has been truncated for brievety)::
 """
 from __future__ import print_function
 import os
-import mimetypes
+import stat
 #
-from pymdeco.utils import checksum_file, get_file_timestamp, find_executable
-from pymdeco.utils import TreeDict
+from pymdeco.utils import format_timestamp, find_executable
+from pymdeco.utils import _cached_checksum_file
+from pymdeco.utils import TreeDict, HASH_ALGORITHMS, DEFAULT_BLOCK_SIZE
 from pymdeco.extractors import get_image_metadata, guess_file_mime
 from pymdeco.extractors import get_multimedia_metadata
 from pymdeco.exceptions import GeneralException, MissingDependencyException
 
+# external modules - must be installed separately; imported once here so
+# ImageInfoScanner.pre_checks() only needs to check the result
+try:
+    import pyexiv2 as _PYEXIV2
+    _PYEXIV2_ERR = None
+except ImportError as ex:
+    _PYEXIV2 = None
+    _PYEXIV2_ERR = ex
+
 
 DEFAULT_MIME_TYPE = 'application/octet-stream'
 
+# BLAKE3 is roughly twice as fast as SHA-256 and can hash a file with multiple
+# threads, so it is preferred when the 'blake3' library is installed
+DEFAULT_HASH_ALGORITHM = 'blake3' if 'blake3' in HASH_ALGORITHMS else 'sha256'
+
+
+def _find_ffprobe():
+    """
+    Returns the path to the :program:`ffprobe` executable or raises
+    :exc:`MissingDependencyException` if it cannot be found in PATH. The
+    lookup is cached by :func:`pymdeco.utils.find_executable` and shared by
+    all scanner instances.
+    """
+    ffprobe_path = find_executable('ffprobe')
+    if ffprobe_path is None:
+        msg = "Cannot find 'ffprobe' executable (in PATH)."
+        raise MissingDependencyException(msg)
+    return ffprobe_path
+
 
 # ---
 class Scanner(object):
@@ -100,7 +128,9 @@ class Scanner(object):
 
     def __init__(self):
         self._methods = list()
+        self._scan_methods = ()
         self._pre_checks_passed = False
+        self._scan_cache = {}
 #        self.pre_checks()
 
     def pre_checks(self):
@@ -145,36 +175,91 @@ class Scanner(object):
         if desc is None:
             desc = str(meth)
 
-        if callable(meth) and hasattr(meth, 'im_class') and \
-           isinstance(self, meth.im_class):
-               self._methods.append((meth, desc))
+        # only methods bound to this instance are accepted; '__self__' is
+        # available for bound methods in both Python 2.6+ and 3.x
+        if callable(meth) and getattr(meth, '__self__', None) is self:
+            self._methods.append((meth, desc))
+            # the bound methods are called by scan() for every file
+            self._scan_methods = tuple(m for m, d in self._methods)
         else:
             msg =   'Argument not callable, not method class or ' + \
                     'does not belong to an instance.'
             raise GeneralException(msg)
 
     # -- public methods and properties
-    def scan(self, fpath):
+    def scan(self, fpath, pre_stat=None):
         """
         Walks through the registered methods, runs them with a single argument
         and then assigns the result to a dictionary and returns it.
         Returns :exc:`GeneralException` if *fpath* is not a valid or if the
         :meth:`pre_checks` method has not been run before.
+
+        *pre_stat* is an optional result of :func:`os.stat` for *fpath* that
+        is already known to the caller (i.e. from :meth:`os.DirEntry.stat`
+        while walking a directory) and is used instead of querying the file
+        system again.
+        """
+        fstat = self._check_scan_path(fpath, pre_stat)
+
+        # shared by the registered methods for the duration of the scan
+        self._scan_cache = {'fpath': fpath, 'stat': fstat}
+        results = TreeDict()
+        update = results.update
+
+        try:
+            for a_method in self._scan_methods:
+                update(a_method(fpath))
+        finally:
+            self._scan_cache = {}
+        return results
+
+
+    def _check_scan_path(self, fpath, pre_stat=None):
+        """
+        Checks if the scanner is ready and *fpath* is a regular file and
+        returns the result of :func:`os.stat` for it (or *pre_stat* if
+        provided). Raises :exc:`GeneralException` otherwise.
         """
         if not self._pre_checks_passed:
             err = "Pre checks have not passed. Run pre_checks() method first."
             raise GeneralException(err)
 
-        if not os.path.isfile(fpath):
+        fstat = pre_stat
+        if fstat is None:
+            try:
+                fstat = os.stat(fpath)
+            except EnvironmentError:
+                fstat = None
+        if fstat is None or not stat.S_ISREG(fstat.st_mode):
             errmsg = 'Path not found or is not a file: ' + fpath
             raise GeneralException(errmsg)
+        return fstat
 
-        results = TreeDict()
 
-        for a_method, desc in self._methods:
-            meth_result = a_method(fpath)
-            results.update(meth_result)
-        return results
+    def _file_stat(self, fpath):
+        """
+        Returns the result of :func:`os.stat` for *fpath*. While
+        :meth:`scan` is running the result is taken from the stat() call
+        done at its start, so the registered methods do not have to query
+        the file system again.
+        """
+        if self._scan_cache.get('fpath') == fpath:
+            return self._scan_cache['stat']
+        return os.stat(fpath)
+
+
+    def _file_mime(self, fpath):
+        """
+        Returns the MIME type of *fpath* as guessed by
+        :func:`pymdeco.extractors.guess_file_mime` (which may be None).
+        While :meth:`scan` is running the MIME type is guessed only once and
+        shared by all registered methods.
+        """
+        if self._scan_cache.get('fpath') != fpath:
+            return guess_file_mime(fpath)
+        if 'mime_type' not in self._scan_cache:
+            self._scan_cache['mime_type'] = guess_file_mime(fpath)
+        return self._scan_cache['mime_type']
 
 
 
@@ -185,10 +270,18 @@ class FileInfoScanner(Scanner):
     along with checksumming the content of the file.
     It can be safely used against any type of file and is always guaranteed to
     produce sensible results.
+
+    The content is checksummed with :data:`DEFAULT_HASH_ALGORITHM` and the
+    name of the algorithm is stored along with the checksum.
+
+    The checksums can be cached between scans by setting :attr:`hash_cache`
+    to an instance of :class:`pymdeco.utils.FileHashCache`. The files that
+    have not changed since they were last scanned are then not read again.
     """
     mime_types = ['*/*'] # this is "catch all" clause
 
     def __init__(self):
+        self.hash_cache = None
         super(FileInfoScanner, self).__init__()
 
         self._register(self._add_file_name)
@@ -199,6 +292,35 @@ class FileInfoScanner(Scanner):
         self._register(self._add_timestamps)
 
 
+    def fast_scan(self, fpath, pre_stat=None, localtime=True):
+        """
+        Collects the same metadata as :meth:`scan` does for a plain
+        :class:`FileInfoScanner`, by calling the methods registered by
+        :class:`FileInfoScanner` directly. As in :meth:`scan`, the file is
+        stat-ed and its MIME type is guessed only once.
+
+        Only the metadata provided by :class:`FileInfoScanner` itself is
+        returned - the methods registered by subclasses (i.e. image or video
+        metadata) are not called. Use :meth:`scan` for these.
+        *pre_stat* has the same meaning as in :meth:`scan`, *localtime* is
+        passed to :func:`pymdeco.utils.format_timestamp`.
+        """
+        fstat = self._check_scan_path(fpath, pre_stat)
+
+        self._scan_cache = {'fpath': fpath, 'stat': fstat}
+        results = TreeDict()
+        try:
+            results.update(self._add_file_name(fpath))
+            results.update(self._add_file_type(fpath))
+            results.update(self._add_size(fpath))
+            results.update(self._add_mime(fpath))
+            results.update(self._add_hash(fpath))
+            results.update(self._add_timestamps(fpath, localtime=localtime))
+        finally:
+            self._scan_cache = {}
+        return results
+
+
     def _add_file_name(self, fpath):
         fname = os.path.basename(fpath)
 
@@ -206,12 +328,25 @@ class FileInfoScanner(Scanner):
         return result
 
 
+    def _checksum(self, fpath, algorithm, block_size=DEFAULT_BLOCK_SIZE,
+                  fstat=None):
+        """
+        Returns the checksum of the file, using :attr:`hash_cache` (if set)
+        to avoid calculating it again for unchanged files. *fstat* is the
+        stat result of the file if it is already known.
+        """
+        if fstat is None:
+            fstat = self._file_stat(fpath)
+        # the file has already been stat-ed, so checksum_file() is not used
+        # as it would do it once again
+        return _cached_checksum_file(fpath, fstat, algorithm, block_size,
+                                     self.hash_cache)
+
+
     def _add_hash(self, fpath,
-                 algorithm='sha256',
-                 block_size=4194304): # 4 * 1024 * 1024 = 4MB
-        checksum = checksum_file(fpath,
-                                 block_size=block_size,
-                                 algorithm=algorithm)
+                 algorithm=DEFAULT_HASH_ALGORITHM,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        checksum = self._checksum(fpath, algorithm, block_size=block_size)
         temp_dict = {}
         temp_dict['algorithm'] = algorithm
         temp_dict['value'] = checksum
@@ -221,30 +356,27 @@ class FileInfoScanner(Scanner):
 
 
     def _add_timestamps(self, fpath, localtime=True):
-        modtime = get_file_timestamp(fpath,
-                                     mode='modified',
-                                     localtime=localtime)
-        crtime = get_file_timestamp(fpath,
-                                    mode='created',
-                                    localtime=localtime)
+        fstat = self._file_stat(fpath)
 
         temp_dict = {}
-        temp_dict['modified'] = '{:%Y-%m-%d %H:%M:%S}'.format(modtime)
-        temp_dict['created'] = '{:%Y-%m-%d %H:%M:%S}'.format(crtime)
+        temp_dict['modified'] = format_timestamp(fstat[stat.ST_MTIME],
+                                                 localtime=localtime)
+        temp_dict['created'] = format_timestamp(fstat[stat.ST_CTIME],
+                                                localtime=localtime)
 
         result = dict(file_timestamps = temp_dict)
         return result
 
 
     def _add_size(self, fpath):
-        fsize = os.path.getsize(fpath)
+        fsize = self._file_stat(fpath).st_size
 
         result = dict(file_size = fsize)
         return result
 
 
     def _add_mime(self, fpath):
-        mt = guess_file_mime(fpath)
+        mt = self._file_mime(fpath)
         if mt is None:
             mt = DEFAULT_MIME_TYPE # unknown type
 
@@ -253,7 +385,7 @@ class FileInfoScanner(Scanner):
 
 
     def _add_file_type(self, fpath):
-        mime = mimetypes.guess_type(fpath)[0]
+        mime = self._file_mime(fpath)
         tp = 'unknown'
         try:
             if not (mime is None):
@@ -291,14 +423,13 @@ class ImageInfoScanner(FileInfoScanner):
         """
         see :meth:`Scanner.pre_checks`
         """
-        try:
-            import pyexiv2
-            self._pyexiv2_version = pyexiv2.__version__
-            self._pre_checks_pass()
-        except ImportError:
+        if _PYEXIV2 is None:
             msg = "pyexiv2 library not installed! " + \
-            "Image metadata extracting is not possible."
+            "Image metadata extracting is not possible. " + \
+            "(" + str(_PYEXIV2_ERR) + ")"
             raise MissingDependencyException(msg)
+        self._pyexiv2_version = _PYEXIV2.__version__
+        self._pre_checks_pass()
 
 
     def _add_image_metadata(self, fpath):
@@ -317,11 +448,10 @@ class ImageInfoScanner(FileInfoScanner):
 
         # pyexiv2 returns the keys in dotted format i.e. "Exif.key.subkey"
         # Use TreeDict to convert them to tree-like/nested dictionaries
+        # TODO: make sure the key and values are string or can be converted
+        # *safely* to a string values
         tree = TreeDict()
-        for key in temp_dict:
-            # TODO: make sure the key and values are string or can be converted
-            # *safely* to a string values
-            tree.add_node(key, temp_dict[key])
+        tree.add_nodes(temp_dict)
 
         result = dict(image_metadata = tree)
         return result
@@ -347,11 +477,7 @@ class VideoInfoScanner(FileInfoScanner):
         """
         see :meth:`Scanner.pre_checks`
         """
-        ffprobe_path = find_executable('ffprobe')
-        if ffprobe_path is None:
-            msg = "Cannot find 'ffprobe' executable (in PATH)."
-            raise MissingDependencyException(msg)
-        self._ffprobe_path = ffprobe_path
+        self._ffprobe_path = _find_ffprobe()
         self._pre_checks_pass()
 
 
@@ -380,11 +506,7 @@ class AudioInfoScanner(FileInfoScanner):
         """
         see :meth:`Scanner.pre_checks`
         """
-        ffprobe_path = find_executable('ffprobe')
-        if ffprobe_path is None:
-            msg = "Cannot find 'ffprobe' executable (in PATH)."
-            raise MissingDependencyException(msg)
-        self._ffprobe_path = ffprobe_path
+        self._ffprobe_path = _find_ffprobe()
         self._pre_checks_pass()
 
 
@@ -405,6 +527,11 @@ class FFprobeScanner(FileInfoScanner):
                   'audio/*'
                  ]
 
+    # the key under which the metadata is stored for each type of content
+    _metadata_keys = {'video': 'video_metadata',
+                      'audio': 'audio_metadata'
+                     }
+
     def __init__(self):
         self._ffprobe_path = None
         super(FFprobeScanner, self).__init__()
@@ -412,22 +539,21 @@ class FFprobeScanner(FileInfoScanner):
 
 
     def pre_checks(self):
-        ffprobe_path = find_executable('ffprobe')
-        if ffprobe_path is None:
-            msg = "Cannot find 'ffprobe' executable (in PATH)."
-            raise MissingDependencyException(msg)
-        self._ffprobe_path = ffprobe_path
+        self._ffprobe_path = _find_ffprobe()
         self._pre_checks_pass()
 
 
     def _add_multimedia_metadata(self, fpath):
+        content_mime = self._file_mime(fpath) or DEFAULT_MIME_TYPE
+        try:
+            meta_key = self._metadata_keys[content_mime.split('/')[0]]
+        except KeyError:
+            errmsg = 'Not an audio or video file: ' + fpath
+            raise GeneralException(errmsg)
+
         temp_dict = get_multimedia_metadata(fpath, self._ffprobe_path)
 
-        content_mime = guess_file_mime(fpath).split('/')[0]
-        if content_mime.startswith('video'):
-            result = dict(video_metadata = temp_dict)
-        elif content_mime.startswith('audio'):
-            result = dict(audio_metadata = temp_dict)
+        result = {meta_key : temp_dict}
         return result
 
 
@@ -131,11 +131,12 @@ class BaseScanService(object):
         return result
 
 
-    def get_metadata(self, fpath):
+    def get_metadata(self, fpath, pre_stat=None):
         """
         Identifies the MIME type of the file path, then finds the
         appropriate scanner in the registry and use it to obtain the metadata
-        from the file.
+        from the file. The optional *pre_stat* is passed to
+        :meth:`pymdeco.scanners.Scanner.scan`.
 
         This method may raise :exc:`ServiceException` if no appropriate MIME
         scanner has been found in the registry (and when no default scanner
@@ -156,7 +157,7 @@ class BaseScanService(object):
             errmsg = "No scanner available for this file/MIME type."
             raise ServiceException(errmsg)
         try:
-            result = scanner.scan(fpath)
+            result = scanner.scan(fpath, pre_stat=pre_stat)
         except GeneralException:
             # TODO: do something sane here
             raise
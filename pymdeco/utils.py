@@ -16,15 +16,77 @@ Contains various utility functions used by the rest of the package.
 """
 from __future__ import print_function
 # internal Python modules
+import binascii
 import hashlib
-import os, stat
+import mimetypes
+import mmap
+import os
 import sys
 import time, datetime
+import functools
 from collections import OrderedDict
 import numbers
-import types
+import re
+import sqlite3
+import struct
+import subprocess
+import threading
+import zlib
+try:
+    text_type = unicode # Python 2.x
+except NameError:
+    text_type = str
+try:
+    # Python 2.x - memoryview cannot be released and zlib.crc32() does not
+    # accept it, see _read_blocks()
+    _buffer = buffer
+except NameError:
+    _buffer = None
+try:
+    from functools import lru_cache
+except ImportError:
+    # Python 2.x - no caching
+    def lru_cache(maxsize=128):
+        return lambda func: func
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    # Python 2.x
+    from pipes import quote as shell_quote
+try:
+    from shutil import which
+except ImportError:
+    # Python 2.x - see _find_executable()
+    which = None
 import json
-from pymdeco.exceptions import GeneralException
+try:
+    # part of the standard library since Python 3.2, available as the
+    # 'futures' backport for Python 2.x
+    from concurrent import futures
+except ImportError:
+    futures = None
+from pymdeco.exceptions import GeneralException, MissingDependencyException
+
+# external modules - optional, must be installed separately
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
+try:
+    import pycrc32
+except ImportError:
+    pycrc32 = None
 
 
 def check_dependencies():
@@ -36,6 +98,11 @@ def check_dependencies():
     if they are present.
     """
     result = {  'pyexiv2': None,
+                'blake3': None,
+                'pycrc32': None,
+                'lmdb': None,
+                'orjson': None,
+                'pymdeco._tree': None,
                 'ffprobe': None
              }
     try:
@@ -45,6 +112,22 @@ def check_dependencies():
     except ImportError:
         pass
 
+    if blake3 is not None:
+        result['blake3'] = 'blake3: ' + str(blake3.__version__)
+    if pycrc32 is not None:
+        result['pycrc32'] = 'pycrc32'
+    if lmdb is not None:
+        result['lmdb'] = 'lmdb: ' + str(lmdb.__version__)
+    if orjson is not None:
+        result['orjson'] = 'orjson: ' + str(orjson.__version__)
+
+    # the compiled tree helpers (built by setup.py when Cython is present)
+    try:
+        import pymdeco._tree
+        result['pymdeco._tree'] = pymdeco._tree.__file__
+    except ImportError:
+        pass
+
     result['ffprobe'] = find_executable('ffprobe')
 
     return result
@@ -52,11 +135,111 @@ def check_dependencies():
 
 # -----------------------------------------------
 # Calculating file's checksum
+
+# hashlib.algorithms exists only in Python 2.7; Python 3.x renamed it
+HASH_ALGORITHMS = getattr(hashlib, 'algorithms', None) or \
+                  tuple(sorted(hashlib.algorithms_guaranteed))
+# the SHAKE algorithms have variable-length digests, so their hexdigest()
+# cannot be called without a length
+HASH_ALGORITHMS = tuple(name for name in HASH_ALGORITHMS
+                        if not name.startswith('shake_'))
+if blake3 is not None:
+    HASH_ALGORITHMS = HASH_ALGORITHMS + ('blake3',)
+# not a cryptographic hash, but fast enough to be limited only by the disk
+HASH_ALGORITHMS = HASH_ALGORITHMS + ('crc32',)
+
+# the amount of data read (and hashed) at once by default; small enough to
+# stay in the CPU cache between reading and hashing it
+DEFAULT_BLOCK_SIZE = 262144 # 256 * 1024 = 256KB
+
+# files of at least this size (in bytes) are memory-mapped and hashed at once
+# by checksum_file() instead of being read block by block; None disables
+# mapping. Off by default: if a mapped file is truncated while it is hashed
+# (i.e. rewritten by another program), reading the pages past its new end
+# kills the whole process with SIGBUS instead of raising an exception.
+MMAP_MIN_SIZE = None
+
+
+class _CRC32Hasher(object):
+    """
+    Calculates CRC32 checksum with an interface compatible with the hash
+    objects from :mod:`hashlib`. Uses the `pycrc32
+    <https://pypi.org/project/pycrc32/>`_ library (which uses the PCLMULQDQ
+    instructions on x86) if it is installed or :func:`zlib.crc32` otherwise.
+    """
+    name = 'crc32'
+
+    # pycrc32 accepts only bytes, so other buffers (i.e. memory maps) are
+    # copied in chunks small enough to stay in the CPU cache
+    _chunk_size = DEFAULT_BLOCK_SIZE
+
+    def __init__(self):
+        self._crc = 0
+        self._hasher = None
+        if pycrc32 is not None:
+            self._hasher = pycrc32.Hasher()
+
+    def update(self, data):
+        if self._hasher is None:
+            self._crc = zlib.crc32(data, self._crc) & 0xffffffff
+        elif isinstance(data, bytes):
+            self._hasher.update(data)
+        else:
+            view = memoryview(data)
+            for offset in range(0, len(view), self._chunk_size):
+                chunk = view[offset:offset + self._chunk_size]
+                self._hasher.update(chunk.tobytes())
+            view.release()
+
+    def hexdigest(self):
+        if self._hasher is not None:
+            # finalize() does not modify the state of the hasher
+            self._crc = self._hasher.finalize()
+        return '%08x' % self._crc
+
+
+def _new_blake3_hasher():
+    # use as many threads as blake3 finds useful for the input size
+    return blake3.blake3(max_threads=blake3.blake3.AUTO)
+
+
+# constructors of the hash objects - one for each of HASH_ALGORITHMS
+_HASHER_FACTORY = {'crc32': _CRC32Hasher}
+if blake3 is not None:
+    _HASHER_FACTORY['blake3'] = _new_blake3_hasher
+for _name in HASH_ALGORITHMS:
+    if _name not in _HASHER_FACTORY:
+        _HASHER_FACTORY[_name] = getattr(hashlib, _name, None) or \
+                                 functools.partial(hashlib.new, _name)
+del _name
+
+
+def _new_hasher(algorithm):
+    """
+    Returns a new hash object for *algorithm* or raises
+    :exc:`GeneralException` if the algorithm is not supported.
+
+    The named constructors (i.e. :func:`hashlib.sha256`) are preferred over
+    :func:`hashlib.new` as they are bound directly to OpenSSL's EVP digests
+    when Python is built against OpenSSL. OpenSSL selects the fastest
+    implementation for the CPU at runtime (including the SHA-NI and ARMv8
+    crypto extensions), so no separate CPU detection is needed here. The
+    constructors are looked up once, when the module is imported.
+    """
+    try:
+        factory = _HASHER_FACTORY[algorithm]
+    except KeyError:
+        errmsg = "Unknown algorithm requested '" +algorithm + "'." + \
+                 "Valid algorithms are : " + str(HASH_ALGORITHMS)
+        raise GeneralException(errmsg)
+    return factory()
+
+
 def checksum_data(data, algorithm='sha256'):
     """
     Calculates checksum of the block of data using the various algorithms
     provided by the Python's standard :mod:`hashlib` module.
-    *algorithm* should be one of the available in :attr:`hashlib.algorithms`
+    *algorithm* should be one of the available in :data:`HASH_ALGORITHMS`
     or :exc:`GeneralException` will be raised.
 
 .. seealso:: Module :mod:`hashlib`
@@ -64,47 +247,575 @@ def checksum_data(data, algorithm='sha256'):
        Documentation of the :mod:`hashlib` module in Python's standard library.
 
     """
-    if not algorithm in hashlib.algorithms:
-        errmsg = "Unknown algorithm requested '" +algorithm + "'." + \
-                 "Valid algorithms are : " + str(hashlib.algorithms)
-        raise GeneralException(errmsg)
-    hasher = hashlib.new(algorithm)
+    hasher = _new_hasher(algorithm)
     hasher.update(data)
     return hasher.hexdigest()
 
 
+def _advise_sequential(fd):
+    """
+    Hints the operating system that the file behind the descriptor *fd* is
+    going to be read sequentially from start to end. On Linux this doubles
+    the read-ahead window so more of the file is already queued to the
+    disk while the previous block is being hashed. Does nothing on systems
+    without :func:`os.posix_fadvise` (i.e. Windows and Python 2.x).
+    """
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            # the hint is not supported for this type of file (i.e. pipes)
+            pass
+
+
+def _map_file(fd):
+    """
+    Returns read-only memory map of the whole file behind the descriptor
+    *fd* or None if the file cannot be mapped (i.e. pipes and other
+    non-seekable files or files larger than the address space).
+    """
+    try:
+        mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError, OverflowError):
+        return None
+    if hasattr(mapped, 'madvise'):
+        # Python 3.8+ only; enables aggressive read-ahead and allows the
+        # kernel to free the already hashed pages early
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped
+
+
+# -----------------------------------------------
+def _checksum_key(fstat, algorithm):
+    """
+    Returns a key (bytes) identifying the content of the file with stat
+    result *fstat* for caching its checksum calculated with *algorithm* or
+    None if the file cannot be identified reliably.
+
+    The modification time alone is not enough, as it can be set back to the
+    old value after rewriting the file (i.e. by 'cp -p', 'rsync -t' or when
+    extracting archives). The inode change time cannot be set from the user
+    space, so it is part of the key too.
+    """
+    mtime_ns = getattr(fstat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(fstat.st_mtime * 1000000000)
+    ctime_ns = getattr(fstat, 'st_ctime_ns', None)
+    if ctime_ns is None:
+        ctime_ns = int(fstat.st_ctime * 1000000000)
+    if not fstat.st_ino:
+        # some file systems (and Python 2.x on Windows) do not provide
+        # inode numbers, so different files would share the same key
+        return None
+    try:
+        key = struct.pack('<QQQqq', fstat.st_dev, fstat.st_ino,
+                          fstat.st_size, mtime_ns, ctime_ns)
+    except struct.error:
+        return None
+    return algorithm.encode('ascii') + b':' + key
+
+
+class _LRUCache(object):
+    """
+    Thread-safe dictionary which keeps only the *maxsize* most recently used
+    items.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value # mark as the most recently used
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# checksums of the files recently hashed by the current process
+_checksum_cache = _LRUCache(maxsize=8192)
+
+# a file modified (or its inode changed) less than this many seconds before
+# it is hashed can still change again within the same timestamp tick (2
+# seconds on FAT), and then its stat result stays the same. Like the "racily
+# clean" entries of git's index, the checksums of such files are not cached.
+_RACY_WINDOW = 2.0
+
+def clear_checksum_cache():
+    """
+    Forgets the checksums of the files hashed so far by :func:`checksum_file`
+    in the current process. The persistent caches (:class:`FileHashCache`)
+    are not affected.
+    """
+    _checksum_cache.clear()
+
+
 # -----------------------------------------------
 def checksum_file(fpath,
-                  algorithm='sha256',  # check hashlib.algorithms for more
-                  block_size=4194304): # 4 * 1024 * 1024 = 4MB
+                  algorithm='sha256',  # check HASH_ALGORITHMS for more
+                  block_size=DEFAULT_BLOCK_SIZE,
+                  hash_cache=None,
+                  use_cache=True):
     """
     Calculates checksum of the file using the various algorithms provided
     by the Python's standard :mod:`hashlib` module.
 
     *fpath* is the absolute path to the file.
-    *algorithm* should be one of the available in :attr:`hashlib.algorithms`
+    *algorithm* should be one of the available in :data:`HASH_ALGORITHMS`
     or :exc:`GeneralException` will be raised.
-    *block_size* is the amount of data read from the file at once.
+    *block_size* is the amount of data read from the file at once (into a
+    reused buffer). If :data:`MMAP_MIN_SIZE` is set, the files of at least
+    that size are memory-mapped instead and hashed without copying their
+    content into Python objects first. Only enable this for files which are
+    not modified while they are hashed - truncating a mapped file crashes
+    the process with SIGBUS.
+
+    If the `blake3 <https://pypi.org/project/blake3/>`_ library is installed,
+    *algorithm* can also be 'blake3'. In this case the file is hashed by
+    multiple threads (and, when it is mapped, *block_size* is not used).
+
+    The checksums of the most recently hashed files are remembered along
+    with the device, inode, size, modification and inode change time of the
+    file, so hashing again the same unchanged file returns immediately (see
+    also :func:`clear_checksum_cache`). If *hash_cache* (an instance of
+    :class:`FileHashCache`) is provided, the checksums are also stored in
+    (and looked up from) this persistent cache, which allows reusing them in
+    later runs. The checksums of the files changed less than 2 seconds
+    before they are hashed are not cached, as another change within the
+    same timestamp tick would not be noticed.
+    If *use_cache* is False, the file is always read and the cached
+    checksum (if any) is replaced with the new one, i.e. for verifying the
+    integrity of the file.
 
 .. seealso:: Module :mod:`hashlib`
 
        Documentation of the :mod:`hashlib` module in Python's standard library.
 
     """
-    if not algorithm in hashlib.algorithms:
-        errmsg = "Unknown algorithm requested '" +algorithm + "'." + \
-                 "Valid algorithms are : " + str(hashlib.algorithms)
-        raise GeneralException(errmsg)
+    return _cached_checksum_file(fpath, os.stat(fpath), algorithm, block_size,
+                                 hash_cache, use_cache)
 
-    hasher = hashlib.new(algorithm)
-    with open(fpath,'rb') as afile:
-        buf = afile.read(block_size)
-        while len(buf) > 0:
-            hasher.update(buf)
-            buf = afile.read(block_size)
+
+def _cached_checksum_file(fpath, fstat, algorithm, block_size,
+                          hash_cache, use_cache=True):
+    """
+    Same as :func:`checksum_file`, but for a file whose stat result *fstat*
+    is already known.
+    """
+    key = _checksum_key(fstat, algorithm)
+    if key is not None and use_cache:
+        checksum = _checksum_cache.get(key)
+        if checksum is None and hash_cache is not None:
+            checksum = hash_cache._get(key)
+            if checksum is not None:
+                _checksum_cache.put(key, checksum)
+        if checksum is not None:
+            return checksum
+
+    hashed_at = time.time()
+    checksum = _checksum_file(fpath, algorithm, block_size, fstat.st_size)
+
+    if key is not None:
+        if hashed_at - max(fstat.st_mtime, fstat.st_ctime) >= _RACY_WINDOW:
+            _checksum_cache.put(key, checksum)
+            if hash_cache is not None:
+                hash_cache._put(key, checksum)
+        elif not use_cache:
+            # too recent to be cached, but the old checksum is not kept
+            # either
+            _checksum_cache.pop(key)
+            if hash_cache is not None:
+                hash_cache._delete(key)
+    return checksum
+
+
+def _checksum_file(fpath, algorithm, block_size, fsize):
+    """
+    Does the actual (uncached) work for :func:`checksum_file`. *fsize* is
+    the size of the file.
+    """
+    hasher = _new_hasher(algorithm)
+    use_mmap = MMAP_MIN_SIZE is not None and fsize >= MMAP_MIN_SIZE
+    if use_mmap and algorithm == 'blake3':
+        hasher.update_mmap(fpath)
+        return hasher.hexdigest()
+
+    # unbuffered, as the data is read directly into our own buffer
+    with open(fpath, 'rb', 0) as afile:
+        mapped = None
+        if use_mmap:
+            mapped = _map_file(afile.fileno())
+
+        if mapped is not None:
+            # hash the whole mapping at once as hashlib releases the GIL for
+            # the duration of the call and no data is copied to Python
+            try:
+                hasher.update(mapped)
+            finally:
+                mapped.close()
+        else:
+            if fsize > block_size:
+                # the read-ahead hint is useless for the files read at once
+                _advise_sequential(afile.fileno())
+            for block in _read_blocks(afile, _get_read_buffer(block_size)):
+                hasher.update(block)
     return hasher.hexdigest()
 
 
+def _read_blocks(afile, buf):
+    """
+    Yields the consecutive blocks of the file *afile*, read into the (reused)
+    bytearray *buf*. The blocks are views of *buf* and not copies, so each
+    one is valid only until the next one is read.
+    """
+    if _buffer is not None:
+        size = afile.readinto(buf)
+        while size:
+            yield _buffer(buf, 0, size)
+            size = afile.readinto(buf)
+        return
+
+    view = memoryview(buf)
+    try:
+        size = afile.readinto(view)
+        while size:
+            yield view[:size]
+            size = afile.readinto(view)
+    finally:
+        view.release()
+
+
+# the read buffers reused by _checksum_file(), one per thread
+_read_buffers = threading.local()
+
+
+def _get_read_buffer(block_size):
+    buf = getattr(_read_buffers, 'buf', None)
+    if buf is None or len(buf) != block_size:
+        buf = _read_buffers.buf = bytearray(block_size)
+    return buf
+
+
+# -----------------------------------------------
+def file_fingerprint(fpath,
+                     algorithm='sha256', # check HASH_ALGORITHMS for more
+                     block_size=DEFAULT_BLOCK_SIZE,
+                     hash_cache=None,
+                     use_cache=True):
+    """
+    Returns a dictionary (instance of :class:`EnhancedDict`) with the 'size'
+    (in bytes), the 'mtime' and 'ctime' timestamps (in seconds since the
+    epoch) and the 'checksum' of the file *fpath*.
+
+    The arguments are the same as for :func:`checksum_file`. Unlike calling
+    :func:`get_file_size`, :func:`get_file_timestamp` and
+    :func:`checksum_file` one after another, the file is stat()-ed only once
+    and the checksum is taken from the cache of :func:`checksum_file` when
+    the file has not changed.
+    """
+    fstat = os.stat(fpath)
+    checksum = _cached_checksum_file(fpath, fstat, algorithm, block_size,
+                                     hash_cache, use_cache)
+    result = EnhancedDict()
+    result['size'] = fstat.st_size
+    result['mtime'] = fstat.st_mtime
+    result['ctime'] = fstat.st_ctime
+    result['checksum'] = checksum
+    return result
+
+
+# -----------------------------------------------
+def checksum_files_batch(paths,
+                         algorithm='sha256',
+                         block_size=DEFAULT_BLOCK_SIZE,
+                         lanes=8):
+    """
+    Calculates the checksums of multiple files at once and returns a list
+    with the checksums in the same order as *paths*.
+
+    Up to *lanes* files are hashed concurrently in separate threads. This is
+    efficient because :mod:`hashlib` releases the GIL while hashing large
+    blocks of data, so the files are processed in parallel on multi-core
+    systems. The rest of the arguments have the same meaning as in
+    :func:`checksum_file`.
+
+    If :mod:`concurrent.futures` is not available the files are hashed
+    sequentially.
+    """
+    paths = list(paths)
+    _new_hasher(algorithm) # fail early if the algorithm is not supported
+
+    if futures is None or lanes < 2 or len(paths) < 2:
+        return [checksum_file(fpath, algorithm=algorithm,
+                              block_size=block_size) for fpath in paths]
+
+    def hash_one(fpath):
+        return checksum_file(fpath, algorithm=algorithm, block_size=block_size)
+
+    workers = min(lanes, len(paths))
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        result = list(executor.map(hash_one, paths))
+    return result
+
+
+def checksum_files(paths,
+                   algorithm='sha256',
+                   workers=None,
+                   block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Same as :func:`checksum_files_batch`, but returns a dictionary (instance
+    of :class:`EnhancedDict`) mapping each of the *paths* to its checksum.
+    The files are hashed by up to *workers* threads (defaults to the number
+    of CPUs) and each file is hashed only once, even if it is listed more
+    than once.
+    """
+    unique_paths = list(OrderedDict.fromkeys(paths))
+    if workers is None:
+        workers = _cpu_count()
+    checksums = checksum_files_batch(unique_paths, algorithm=algorithm,
+                                     block_size=block_size, lanes=workers)
+    return EnhancedDict(zip(unique_paths, checksums))
+
+
+def _cpu_count():
+    # os.cpu_count() is available only in Python 3.4+ and may return None
+    cpu_count = getattr(os, 'cpu_count', None)
+    result = cpu_count() if cpu_count is not None else None
+    return result or 1
+
+
+# -----------------------------------------------
+DEFAULT_HASH_CACHE_PATH = os.path.join(os.path.expanduser('~'),
+                                       '.cache', 'pymdeco', 'hash.mdb')
+DEFAULT_SQLITE_HASH_CACHE_PATH = os.path.join(os.path.expanduser('~'),
+                                              '.cache', 'pymdeco',
+                                              'hash.sqlite')
+
+
+class FileHashCache(object):
+    """
+    Persistent cache for file checksums stored in a database at *path*.
+
+    *backend* selects the type of the database:
+
+    * 'lmdb' (the default) - `LMDB <https://pypi.org/project/lmdb/>`_
+      database, *path* defaults to :data:`DEFAULT_HASH_CACHE_PATH`. Raises
+      :exc:`MissingDependencyException` if the 'lmdb' library is not
+      installed.
+    * 'sqlite' - SQLite database (always available as it is part of the
+      Python's standard library), *path* defaults to
+      :data:`DEFAULT_SQLITE_HASH_CACHE_PATH`.
+
+    The checksums are looked up by the device, inode, size, modification and
+    inode change time of the file as returned by :func:`os.stat`, so
+    re-scanning files that have not changed since the last scan does not
+    require reading them again. Modifying a file also changes its inode
+    change time (even if the modification time is restored afterwards),
+    which makes the old cached value unreachable. Both backends store the
+    same keys and the raw (binary) digests.
+
+    Errors from the database are ignored (getting a value behaves as if it
+    is not in the cache), so a broken cache never prevents the checksum
+    from being calculated. The database can be used by multiple processes
+    and threads at the same time. Call :meth:`close` when the cache is not
+    needed anymore.
+    """
+
+    # LMDB only reserves the address space, the file grows as needed
+    map_size = 1073741824 # 1024 * 1024 * 1024 = 1GB
+
+    def __init__(self, path=None, backend='lmdb'):
+        if backend == 'lmdb':
+            if lmdb is None:
+                msg = "lmdb library not installed! " + \
+                      "Persistent checksum cache is not available."
+                raise MissingDependencyException(msg)
+            if path is None:
+                path = DEFAULT_HASH_CACHE_PATH
+        elif backend == 'sqlite':
+            if path is None:
+                path = DEFAULT_SQLITE_HASH_CACHE_PATH
+        else:
+            raise GeneralException("Unknown checksum cache backend: '" +
+                                   str(backend) + "'. Valid values are " +
+                                   "'lmdb' and 'sqlite'.")
+        self.path = path
+        self.backend = backend
+        self._env = None
+        self._env_pid = None
+        self._connections = threading.local()
+        # the sqlite3 connections of all threads (with the pid of the
+        # process which opened them), see close()
+        self._open_connections = []
+        self._lock = threading.Lock()
+
+
+    def _make_dirs(self):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+
+    def _get_env(self):
+        # LMDB environments must not be used after fork(), so each process
+        # (i.e. the workers of a process pool) opens its own
+        if self._env is None or self._env_pid != os.getpid():
+            self._make_dirs()
+            self._env = _open_lmdb_env(self.path, self.map_size)
+            self._env_pid = os.getpid()
+        return self._env
+
+
+    def _get_connection(self):
+        # sqlite3 connections cannot be shared between threads nor used
+        # after fork(), so there is one per thread and process
+        local = self._connections
+        if getattr(local, 'connection', None) is None or \
+           local.pid != os.getpid():
+            self._make_dirs()
+            # used only by this thread, but closed by the one calling close()
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            # losing the last few entries after a crash is fine for a cache,
+            # but waiting for the disk on every new entry is not
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS checksums ' +
+                               '(key BLOB PRIMARY KEY, digest BLOB)')
+            local.connection = connection
+            local.pid = os.getpid()
+            with self._lock:
+                self._open_connections.append((local.pid, connection))
+        return local.connection
+
+
+    def close(self):
+        """
+        Closes the database connections opened by this instance in the
+        current process (for all threads). Must not be called while other
+        threads use the cache. Using the cache again later reopens the
+        database.
+
+        The LMDB environment is shared by all instances with the same *path*
+        and stays open.
+        """
+        with self._lock:
+            connections = self._open_connections
+            self._open_connections = []
+            # forget the connections of the other threads as well
+            self._connections = threading.local()
+        for pid, connection in connections:
+            if pid == os.getpid():
+                connection.close()
+        self._env = None
+
+
+    def get(self, fstat, algorithm):
+        """
+        Returns the cached checksum (as hex string) of the file with stat
+        result *fstat* calculated with *algorithm* or None if it is unknown.
+        """
+        key = _checksum_key(fstat, algorithm)
+        if key is None:
+            return None
+        return self._get(key)
+
+
+    def put(self, fstat, algorithm, checksum):
+        """
+        Stores the *checksum* (as hex string) of the file with stat result
+        *fstat* calculated with *algorithm*.
+        """
+        key = _checksum_key(fstat, algorithm)
+        if key is None:
+            return
+        self._put(key, checksum)
+
+
+    def _get(self, key):
+        # *key* as returned by _checksum_key()
+        try:
+            if self.backend == 'lmdb':
+                with self._get_env().begin() as txn:
+                    digest = txn.get(key)
+            else:
+                row = self._get_connection().execute(
+                    'SELECT digest FROM checksums WHERE key = ?',
+                    (sqlite3.Binary(key),)).fetchone()
+                digest = None if row is None else bytes(row[0])
+        except (EnvironmentError, sqlite3.Error) + _LMDB_ERRORS:
+            return None
+        if digest is None:
+            return None
+        return binascii.hexlify(digest).decode('ascii')
+
+
+    def _put(self, key, checksum):
+        digest = binascii.unhexlify(checksum)
+        try:
+            if self.backend == 'lmdb':
+                with self._get_env().begin(write=True) as txn:
+                    txn.put(key, digest)
+            else:
+                connection = self._get_connection()
+                with connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO checksums (key, digest) ' +
+                        'VALUES (?, ?)',
+                        (sqlite3.Binary(key), sqlite3.Binary(digest)))
+        except (EnvironmentError, sqlite3.Error) + _LMDB_ERRORS:
+            pass
+
+
+    def _delete(self, key):
+        try:
+            if self.backend == 'lmdb':
+                with self._get_env().begin(write=True) as txn:
+                    txn.delete(key)
+            else:
+                connection = self._get_connection()
+                with connection:
+                    connection.execute('DELETE FROM checksums WHERE key = ?',
+                                       (sqlite3.Binary(key),))
+        except (EnvironmentError, sqlite3.Error) + _LMDB_ERRORS:
+            pass
+
+
+# errors from the LMDB databases, ignored by FileHashCache
+_LMDB_ERRORS = (lmdb.Error,) if lmdb is not None else ()
+
+# LMDB does not allow opening the same database twice in one process, so
+# all FileHashCache instances with the same path share the environment
+_lmdb_envs = {}
+_lmdb_envs_lock = threading.Lock()
+
+
+def _open_lmdb_env(path, map_size):
+    key = (os.path.abspath(path), os.getpid())
+    with _lmdb_envs_lock:
+        env = _lmdb_envs.get(key)
+        if env is None:
+            env = lmdb.open(path, map_size=map_size, subdir=False)
+            _lmdb_envs[key] = env
+        return env
+
+
 # -----------------------------------------------
 def get_file_timestamp(filepath, mode="modified", localtime=True):
     """
@@ -129,21 +840,55 @@ def get_file_timestamp(filepath, mode="modified", localtime=True):
     #    return datetime.datetime.fromtimestamp(t)
 
     if mode == "modified":
-        ftimestamp = os.stat(filepath)[stat.ST_MTIME]
+        ftimestamp = os.stat(filepath).st_mtime
     elif mode == "created":
-        ftimestamp = os.stat(filepath)[stat.ST_CTIME]
+        ftimestamp = os.stat(filepath).st_ctime
     else:
         raise GeneralException("Unknown 'mode' provided: '" + str(mode) + \
                         ". Valid values are 'created' and 'modified'.")
 
+    result = timestamp_to_datetime(ftimestamp, localtime=localtime)
+    return result
+
+
+# -----------------------------------------------
+def timestamp_to_datetime(ftimestamp, localtime=True):
+    """
+    Converts a timestamp in seconds since the epoch (as found in the result
+    of :func:`os.stat`) to :class:`datetime.datetime` object.
+
+    If *localtime* is *False* the the time stamp will be in in GMT,
+    otherwise it will be converted to the local system's time. The fractions
+    of the second are dropped.
+    """
+    ftimestamp = ftimestamp // 1 # whole seconds, rounded down
+    if localtime:
+        result = datetime.datetime.fromtimestamp(ftimestamp)
+    else:
+        # datetime.utcfromtimestamp() is deprecated since Python 3.12
+        result = _EPOCH + datetime.timedelta(seconds=ftimestamp)
+
+    return result
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+# -----------------------------------------------
+def format_timestamp(ftimestamp, localtime=True):
+    """
+    Converts a timestamp in seconds since the epoch to a string in the format
+    "yyyy-mm-dd hh:mm:ss". The result is the same as formatting the output of
+    :func:`timestamp_to_datetime` with '{:%Y-%m-%d %H:%M:%S}', but avoids
+    creating the intermediate :class:`datetime.datetime` object and parsing
+    the strftime() format on every call.
+    """
     if localtime:
         ts = time.localtime(ftimestamp)
     else:
         ts = time.gmtime(ftimestamp)
 
-    result = datetime.datetime(ts.tm_year, ts.tm_mon, ts.tm_mday,
-                               ts.tm_hour, ts.tm_min, ts.tm_sec)
-
+    result = '%04d-%02d-%02d %02d:%02d:%02d' % ts[:6]
     return result
 
 
@@ -155,15 +900,73 @@ def get_file_size(fpath):
     return os.path.getsize(fpath)
 
 
+# -----------------------------------------------
+# MIME type lookup tables, built once at import from the same system files
+# used by the :mod:`mimetypes` module (without reloading them if they have
+# been loaded, as that would drop the types added with add_type())
+if not mimetypes.inited:
+    mimetypes.init()
+_MIME_SUFFIX_MAP = dict(mimetypes.suffix_map)
+_MIME_ENCODINGS_MAP = dict(mimetypes.encodings_map)
+_MIME_TYPES_MAP = dict(mimetypes.types_map)
+
+
+def _mimetypes_ignores_case():
+    """
+    Checks if :mod:`mimetypes` looks up the extensions only in lower case
+    (since Python 3.9), instead of trying the exact case first.
+    """
+    # a private instance, without the system files and the global tables
+    db = mimetypes.MimeTypes(filenames=())
+    db.add_type('application/x-pymdeco-test', '.PYMDECO')
+    return db.guess_type('file.PYMDECO')[0] is None
+
+_MIME_IGNORES_CASE = _mimetypes_ignores_case()
+
+
+def guess_mime_by_ext(fname):
+    """
+    Returns the MIME type guessed by the extension of the file name *fname*
+    (which may also be a full path) or None if the extension is unknown.
+
+    The result is the same as the one from :func:`mimetypes.guess_type`, but
+    the lookup uses tables built at import and the results for the most
+    recently used file names are cached. Thus the types added with
+    :func:`mimetypes.add_type` after importing this module are not known.
+    """
+    return _guess_mime_by_basename(os.path.basename(fname))
+
+
+@lru_cache(maxsize=256)
+def _guess_mime_by_basename(fname):
+    # follows the same steps as mimetypes.MimeTypes.guess_type()
+    base, ext = os.path.splitext(fname)
+    key = ext.lower() if _MIME_IGNORES_CASE else ext
+    while key in _MIME_SUFFIX_MAP:
+        base, ext = os.path.splitext(base + _MIME_SUFFIX_MAP[key])
+        key = ext.lower() if _MIME_IGNORES_CASE else ext
+    # always case sensitive
+    if ext in _MIME_ENCODINGS_MAP:
+        base, ext = os.path.splitext(base)
+    if _MIME_IGNORES_CASE:
+        return _MIME_TYPES_MAP.get(ext.lower())
+    return _MIME_TYPES_MAP.get(ext) or _MIME_TYPES_MAP.get(ext.lower())
+
+
 # -----------------------------------------------
 def escape_file_name(fname):
     """
     Helper function to safely convert the file name (a.k.a. escaping) with
     spaces which can cause issues when passing over to the command line.
+
+    The result is quoted for the POSIX shell (including the '$', '`' and
+    '\\' characters) or for the Windows command line. Whenever possible,
+    pass the arguments as a list to :mod:`subprocess` instead (without
+    shell), so no escaping is needed at all.
     """
-    result = fname.replace('\"', '\\"') # escapes double quotes first
-    result = ['"',result,'"']
-    return "".join(result)
+    if sys.platform.startswith('win'):
+        return subprocess.list2cmdline([fname])
+    return shell_quote(fname)
 
 
 # -----------------------------------------------
@@ -189,11 +992,55 @@ def find_executable(executable, path=None):
     string listing directories separated by 'os.pathsep'; defaults to
     os.environ['PATH']).
     Returns the complete filename or None if no such file is found.
+
+    The found files are cached for each combination of *executable* and
+    *path* (and the current directory if the result depends on it), so
+    repeated lookups (i.e. by every new scanner instance) are practically
+    free. Changing os.environ['PATH'] or the current directory invalidates
+    the cached results. Executables which are not found are searched for
+    again on the next call, so the programs installed later are found.
     """
 
     if path is None:
         path = os.environ['PATH']
 
+    cwd = None
+    if _depends_on_cwd(executable, path):
+        cwd = os.getcwd()
+    key = (executable, path, cwd)
+    result = _found_executables.get(key)
+    if result is None:
+        result = _find_executable(executable, path)
+        if result is not None:
+            _found_executables[key] = result
+    return result
+
+
+# the executables found by find_executable(), by (executable, path, current
+# directory or None if the result does not depend on it)
+_found_executables = {}
+
+
+def _depends_on_cwd(executable, path):
+    """
+    Checks if :func:`_find_executable` searches for *executable* in
+    locations relative to the current directory.
+    """
+    if os.path.isabs(executable):
+        return False
+    if os.path.dirname(executable) or sys.platform == 'win32' or \
+       which is None:
+        # a path relative to the current directory, or the current
+        # directory is searched first (on Windows and by the loop below)
+        return True
+    # relative (or empty) directories listed in PATH
+    return not all(os.path.isabs(p) for p in path.split(os.pathsep))
+
+
+def _find_executable(executable, path):
+    """
+    Does the actual (uncached) search for :func:`find_executable`.
+    """
     paths = path.split(os.pathsep)
     extlist = ['']
     if sys.platform == 'win32':
@@ -205,6 +1052,18 @@ def find_executable(executable, path=None):
         if ext.lower() not in pathext:
             extlist = pathext
 
+    if len(extlist) > 1 and not os.path.dirname(executable) and \
+       hasattr(os, 'scandir'):
+        # the current directory is searched first, as by the Windows shell
+        return _find_executable_in_dirs(executable, [os.curdir] + paths,
+                                        extlist)
+
+    if which is not None:
+        result = which(executable, path=path)
+        if result is not None:
+            result = os.path.abspath(result)
+        return result
+
     result = None
     for ext in extlist:
         execname = executable + ext
@@ -224,7 +1083,56 @@ def find_executable(executable, path=None):
     return result
 
 
+def _find_executable_in_dirs(executable, paths, extlist):
+    """
+    Searches the directories *paths* for *executable* with any of the
+    extensions in *extlist* (in this order) and returns the absolute path of
+    the first match or None. The file names are compared case-insensitively
+    (as on Windows).
+
+    Every directory is listed only once with :func:`os.scandir`, instead of
+    checking each combination of an extension and a directory with separate
+    system calls. Long lists of directories are read by several threads at
+    once, so the waiting for slow (i.e. network) drives overlaps.
+    """
+    candidates = [(executable + ext).lower() for ext in extlist]
+    if futures is not None and len(paths) >= 8:
+        with futures.ThreadPoolExecutor(max_workers=4) as executor:
+            listings = list(executor.map(_list_dir_entries, paths))
+    else:
+        listings = (_list_dir_entries(p) for p in paths)
+
+    for entries in listings:
+        if entries is None:
+            continue
+        for candidate in candidates:
+            entry = entries.get(candidate)
+            if entry is not None and entry.is_file() and \
+               os.access(entry.path, os.X_OK):
+                return os.path.abspath(entry.path)
+    return None
+
+
+def _list_dir_entries(dirname):
+    """
+    Returns a dictionary mapping the lower case names of the entries in the
+    directory *dirname* to :class:`os.DirEntry` objects or None if the
+    directory cannot be read.
+    """
+    try:
+        return dict((entry.name.lower(), entry)
+                    for entry in os.scandir(dirname or os.curdir))
+    except OSError:
+        # i.e. missing or not accessible directories listed in PATH
+        return None
+
+
 # -----------------------------------------------
+# strings with a decimal point and/or an exponent, i.e. '1.5', '.5', '2e10'
+_FLOAT_RE = re.compile(r'\s*[-+]?(?:\d+\.\d*|\.\d+|\d+(?=[eE]))' +
+                       r'(?:[eE][-+]?\d+)?\s*$')
+
+
 def get_as_number_if_possible(arg):
     """
     Tries to identify if the argument is a number (Rational, Number, Fraction
@@ -232,34 +1140,30 @@ def get_as_number_if_possible(arg):
     float. If the conversion is not successful, then it returns the argument
     as it is.
     """
-    result = arg
     if isinstance(arg, numbers.Number):
         # 'arg' is already a number - return it as it is
         # TODO: check if it is a numbers.Fraction and if the denominator == 1
         # then return the numerator part only
-        pass # result = arg
-    else:
-        sarg = str(arg).lower()
-        if sarg.count('.') == 1 or sarg.count('e') == 1:
-            # looks like a float, let's try to convert it to float then
-            try:
-                result = float(arg)
-            except ValueError:
-                # apparently it is not a float - return it as it is
-                result = arg
-        elif sarg.isdigit():
-            # try to convert it to an integer (using 10 as base)
-            try:
-                result = int(arg)
-            except ValueError:
-                # apparently it is not an int (or may be not in base 10) so
-                # just return the original argument as it is
-                result = arg
-        else:
-            # then it must be something else - return the original value
-            result = arg
+        return arg
 
-    return result
+    sarg = arg if isinstance(arg, str) else str(arg)
+    if sarg.isdigit():
+        # try to convert it to an integer (using 10 as base)
+        try:
+            return int(sarg)
+        except ValueError:
+            # apparently it is not an int (or may be not in base 10) so
+            # just return the original argument as it is
+            return arg
+    if _FLOAT_RE.match(sarg):
+        # looks like a float, let's try to convert it to float then
+        try:
+            return float(sarg)
+        except ValueError:
+            # apparently it is not a float - return it as it is
+            return arg
+    # then it must be something else - return the original value
+    return arg
 
 
 # -----------------------------------------------
@@ -273,11 +1177,54 @@ class EnhancedDict(OrderedDict):
         """
         Converts the dictionary into JSON format. Any arguments provided are
         passed to :func:`json.dumps`.
+
+        If the much faster `orjson <https://pypi.org/project/orjson/>`_
+        library is installed, it is used instead for
+        ``to_json(indent=2, ensure_ascii=False)`` (optionally with
+        *sort_keys*), as it produces the same layout. :func:`json.dumps` is
+        still used for everything orjson would serialize differently or not
+        at all: non-string keys, integers beyond 64 bits, :mod:`datetime`
+        objects and dataclasses (which :func:`json.dumps` rejects as well)
+        and other unsupported types. The remaining differences are:
+
+        * floats with exponent are written as '1e16' instead of '1e+16'
+        * NaN and Infinity (which are not valid JSON) are written as null
+        * :class:`uuid.UUID` and :class:`enum.Enum` values are written as
+          strings/their values, while :func:`json.dumps` raises
+          :exc:`TypeError` for them
         """
+        if orjson is not None and not args and _is_orjson_compatible(kwargs):
+            # the types passed through are rejected by orjson, so they get
+            # the same treatment (TypeError) from json.dumps() below
+            option = orjson.OPT_INDENT_2 | \
+                     orjson.OPT_PASSTHROUGH_DATETIME | \
+                     orjson.OPT_PASSTHROUGH_DATACLASS
+            if kwargs.get('sort_keys'):
+                option |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(self, option=option).decode('utf-8')
+            except TypeError:
+                pass # i.e. non-string keys or an unsupported type
         result = json.dumps(self, *args, **kwargs)
         return result
 
 
+def _is_orjson_compatible(kwargs):
+    """
+    Checks if orjson produces the same output as :func:`json.dumps` called
+    with the keyword arguments *kwargs* (see :meth:`EnhancedDict.to_json`).
+    """
+    # orjson supports only 2 spaces indentation and never escapes non-ASCII
+    # characters
+    return kwargs.get('indent') == 2 and \
+           kwargs.get('ensure_ascii', True) is False and \
+           _ORJSON_KWARGS.issuperset(kwargs)
+
+
+# the keyword arguments of json.dumps() which orjson can reproduce
+_ORJSON_KWARGS = frozenset(['indent', 'ensure_ascii', 'sort_keys'])
+
+
 # -----------------------------------------------
 def flatten_tree_dict(tree_dict, sep=u'.'):
     """
@@ -321,26 +1268,52 @@ def flatten_tree_dict(tree_dict, sep=u'.'):
 
     """
     
-    result = EnhancedDict()
-    stack = list()
-
-    root = (None, tree_dict) # create tuple (parentkey, dict)
-    stack.append(root)
-
-    while len(stack) > 0:
-        parentkey, subdict = stack.pop()
-        for key in subdict:
-            element = subdict[key]
-            strkey = unicode(key) # should be converted to str() for Python 3.x
-            newkey = strkey if parentkey is None else \
-                     u''.join([parentkey, sep, strkey])
-            if not isinstance(element, types.DictionaryType):
-                result[newkey] = element
-            else:
-                branch = (newkey, element) # create tuple (parentkey, dict)
-                stack.append(branch)
-    
-    return result
+    return EnhancedDict(_iter_tree_leaves(None, tree_dict, sep))
+
+
+def _iter_tree_leaves(parentkey, subdict, sep):
+    """
+    Yields the (flat key, value) pairs for all leaves of *subdict*, whose
+    keys are prefixed with *parentkey* (unless it is None).
+    """
+    for key, element in subdict.items():
+        strkey = key if isinstance(key, text_type) else text_type(key)
+        newkey = strkey if parentkey is None else parentkey + sep + strkey
+        if isinstance(element, dict):
+            for leaf in _iter_tree_leaves(newkey, element, sep):
+                yield leaf
+        else:
+            yield newkey, element
+
+
+def _get_tree_branch(root, split_keys):
+    """
+    Returns the nested dictionary of *root* found by following the list of
+    keys *split_keys*, creating the missing branches along the way.
+    """
+    current_dict = root
+    for key in split_keys:
+        sub_element = current_dict.setdefault(key, {})
+        
+        # check if the sub_element is a dictionary and ifit isn't then
+        # convert it to one. This logic also prevents overwriting existing
+        # leaves with sub-dictionary as the leaf is also converted to a
+        # dictionary key with value set to None
+        if not isinstance(sub_element, dict):
+            sub_element = {sub_element : None}
+            current_dict[key] = sub_element
+
+        current_dict = sub_element
+    return current_dict
+
+
+# use the compiled versions of the tree helpers above if the optional
+# extension module has been built (requires Cython, see setup.py)
+try:
+    from pymdeco._tree import iter_tree_leaves as _iter_tree_leaves
+    from pymdeco._tree import get_tree_branch as _get_tree_branch
+except ImportError:
+    pass
 
 
 # -----------------------------------------------
@@ -398,20 +1371,63 @@ class TreeDict(EnhancedDict):
         split_keys = sep_key.split(sep)
         last_key = split_keys.pop() # extract the last element
 
-        current_dict = self
-        for key in split_keys:
-            sub_element = current_dict.get(key,{})
-            
-            # check if the sub_element is a dictionary and ifit isn't then
-            # convert it to one. This logic also prevents overwriting existing
-            # leaves with sub-dictionary as the leaf is also converted to a
-            # dictionary key with value set to None
-            if not isinstance(sub_element, dict):
-                sub_element = {sub_element : None}
+        self._get_branch(split_keys)[last_key] = val
 
-            current_dict[key] = sub_element
-            current_dict = sub_element
-        current_dict[last_key] = val
+
+    def add_nodes(self, items, sep=u'.'):
+        """
+        Adds multiple "leaf" nodes at once. *items* is a dictionary or an
+        iterable with (key, value) pairs where the keys are the same as the
+        ones accepted by :meth:`add_node`.
+
+        The result is the same as calling :meth:`add_node` for every item,
+        but the branches already found are remembered, so the nodes sharing
+        the same parent (i.e. "Exif.Image.Make" and "Exif.Image.Model") do
+        not walk the tree again.
+
+        Example::
+
+            >>> t = TreeDict()
+            >>> t.add_nodes([('Exif.Image.Make', 'Maker'),
+            ...              ('Exif.Image.Model', 'Model')])
+            >>> print(t.to_json(indent=2))
+            {
+              "Exif": {
+                "Image": {
+                  "Make": "Maker",
+                  "Model": "Model"
+                }
+              }
+            }
+
+        """
+        if isinstance(items, dict):
+            items = items.items()
+
+        branches = {}
+        for sep_key, val in items:
+            parent_key, found, last_key = sep_key.rpartition(sep)
+            if not found:
+                current_dict = self
+            else:
+                current_dict = branches.get(parent_key)
+                if current_dict is None:
+                    current_dict = self._get_branch(parent_key.split(sep))
+                    branches[parent_key] = current_dict
+
+            if isinstance(current_dict.get(last_key), dict):
+                # a whole branch is replaced by a leaf, so some of the
+                # remembered branches may not be part of the tree anymore
+                branches.clear()
+            current_dict[last_key] = val
+
+
+    def _get_branch(self, split_keys):
+        """
+        Returns the nested dictionary found by following the list of keys
+        *split_keys*, creating the missing branches along the way.
+        """
+        return _get_tree_branch(self, split_keys)
 
 
     def to_flatten(self, sep='.'):
@@ -428,17 +1444,17 @@ class TreeDict(EnhancedDict):
                 }
               }, 
               "answer": {
+                "42": null, 
                 "to": {
                   "everything": 42
-                }, 
-                "42": null
+                }
               }
             }
             >>> print(t.to_flatten().to_json(indent=2))
             {
+              "a.b.c": 3, 
               "answer.42": null, 
-              "answer.to.everything": 42, 
-              "a.b.c": 3
+              "answer.to.everything": 42
             }
 
         """
@@ -15,6 +15,7 @@ import shutil
 import runpy
 from distutils.core import setup
 from distutils.core import Command
+from distutils.extension import Extension
 from distutils.command.build import build
 from sphinx import setup_command
 
@@ -24,6 +25,13 @@ if sys.platform.startswith('win'):
     except ImportError:
         print('WARNING: No py2exe module installed!')
 
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    cythonize = None
+    print('WARNING: No Cython module installed! ' +
+          'The optional C extensions will not be built.')
+
 # ---
 def remove_dir(dirname):
     removed = False
@@ -112,10 +120,11 @@ class CleanCommand(Command):
         print ("  deleting ./dist: ",dist_dir)
         remove_dir(dist_dir)
 
-        print ("Removing .pyc and .pyo compiled files")
+        print ("Removing .pyc and .pyo compiled files and C extensions")
         pyc_files = find_files(SETUP_DIR,"*.pyc")
         pyo_files = find_files(SETUP_DIR,"*.pyo")
-        filelist = pyc_files + pyo_files
+        ext_files = find_files(os.path.join(SETUP_DIR, LIB_NAME),"_tree.c")
+        filelist = pyc_files + pyo_files + ext_files
         for f in filelist:
             print ('  deleting:',f)
             os.remove(f)
@@ -174,6 +183,12 @@ LIB_INIT_VARS = runpy.run_path(lib_init_py)
 
 LONG_DESCRIPTON = read_txt_file('README.md')
 
+# optional C extensions - faster versions of some of the pure Python code
+EXT_MODULES = []
+if cythonize is not None:
+    EXT_MODULES = cythonize([Extension(LIB_NAME + '._tree',
+                                       [os.path.join(LIB_NAME, '_tree.pyx')])])
+
 
 setup(
     name= LIB_NAME,
@@ -208,6 +223,7 @@ setup(
         ],
     platforms=['any'],
     packages = get_subpackages(LIB_NAME),
+    ext_modules = EXT_MODULES,
     options = {'py2exe': {
                            'bundle_files': 1
                         }
@@ -1,3 +1,860 @@
 # -*- coding: utf-8 -*-
-# TODO: do test suite
+#
+# Author: Todor Bukov
+# License: LGPL version 3.0 - see LICENSE.txt for details
+#
+"""
+Unit tests for PyMDECO.
 
+Run from the top directory of the source distribution with::
+
+    python -m unittest discover -s tests -p "test_*.py"
+"""
+
+import datetime
+import fractions
+import hashlib
+import json
+import mimetypes
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+try:
+    from StringIO import StringIO # Python 2.x
+except ImportError:
+    from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metadump
+from pymdeco import utils
+from pymdeco.exceptions import GeneralException
+from pymdeco.scanners import Scanner, FileInfoScanner
+from pymdeco.services import FileMetadataService
+
+
+class _TempDirTestCase(unittest.TestCase):
+    """
+    Base class for the tests working with files in a temporary directory.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, data):
+        fpath = os.path.join(self.tmpdir, name)
+        with open(fpath, 'wb') as f:
+            f.write(data)
+        return fpath
+
+
+# -----------------------------------------------
+class ChecksumDataTest(unittest.TestCase):
+
+    def test_same_as_hashlib(self):
+        data = b'The quick brown fox jumps over the lazy dog'
+        for algorithm in ('md5', 'sha1', 'sha256', 'sha512'):
+            self.assertEqual(utils.checksum_data(data, algorithm),
+                             hashlib.new(algorithm, data).hexdigest())
+
+    def test_all_algorithms(self):
+        # every advertised algorithm must produce a (fixed length) digest
+        for algorithm in utils.HASH_ALGORITHMS:
+            checksum = utils.checksum_data(b'data', algorithm)
+            self.assertEqual(len(utils.checksum_data(b'other', algorithm)),
+                             len(checksum))
+            int(checksum, 16) # a hex string
+
+    def test_unknown_algorithm(self):
+        self.assertRaises(GeneralException, utils.checksum_data, b'',
+                          'no_such_algorithm')
+
+
+# -----------------------------------------------
+class ChecksumFileTest(_TempDirTestCase):
+
+    def test_crc32_same_as_zlib(self):
+        for size in (0, 1, 1000, 100000):
+            data = os.urandom(size)
+            expected = '%08x' % (zlib.crc32(data) & 0xffffffff)
+            self.assertEqual(utils.checksum_data(data, 'crc32'), expected)
+            fpath = self._write('f%d' % size, data)
+            self.assertEqual(utils.checksum_file(fpath, 'crc32',
+                                                 block_size=4096),
+                             expected)
+
+    def test_read_and_mapped(self):
+        data = os.urandom(5000)
+        fpath = self._write('f', data)
+        old_mmap_min_size = utils.MMAP_MIN_SIZE
+        try:
+            # not mapped at all, then mapped, then too small to be mapped
+            for mmap_min_size in (None, 1024, 10000):
+                utils.MMAP_MIN_SIZE = mmap_min_size
+                for algorithm in ('md5', 'sha1', 'sha256', 'crc32'):
+                    for block_size in (1024, 4999, 5000, 10000):
+                        utils.clear_checksum_cache()
+                        self.assertEqual(
+                            utils.checksum_file(fpath, algorithm,
+                                                block_size=block_size),
+                            utils.checksum_data(data, algorithm))
+        finally:
+            utils.MMAP_MIN_SIZE = old_mmap_min_size
+
+    def test_not_mapped_by_default(self):
+        fpath = self._write('f', b'x' * 100000)
+        old_map_file = utils._map_file
+        utils._map_file = None # fails if called
+        try:
+            self.assertEqual(utils.checksum_file(fpath, 'md5',
+                                                 block_size=1024),
+                             utils.checksum_data(b'x' * 100000, 'md5'))
+        finally:
+            utils._map_file = old_map_file
+
+    def test_read_buffer_reused(self):
+        # the (per thread) read buffer must not leak data between the files
+        for data, block_size in ((b'a' * 3000, 4096), (b'b' * 10, 4096),
+                                 (b'c' * 20, 20), (b'', 4096)):
+            fpath = self._write('f', data)
+            self.assertEqual(utils.checksum_file(fpath, 'md5',
+                                                 block_size=block_size),
+                             utils.checksum_data(data, 'md5'))
+
+    @unittest.skipIf(utils.blake3 is None, 'blake3 library not installed')
+    def test_blake3(self):
+        data = b'data' * 100000
+        fpath = self._write('f', data)
+        old_mmap_min_size = utils.MMAP_MIN_SIZE
+        try:
+            for mmap_min_size in (None, 1024):
+                utils.MMAP_MIN_SIZE = mmap_min_size
+                utils.clear_checksum_cache()
+                self.assertEqual(utils.checksum_file(fpath, 'blake3'),
+                                 utils.blake3.blake3(data).hexdigest())
+        finally:
+            utils.MMAP_MIN_SIZE = old_mmap_min_size
+        self.assertEqual(utils.checksum_data(data, 'blake3'),
+                         utils.blake3.blake3(data).hexdigest())
+
+
+# -----------------------------------------------
+class ChecksumCacheTest(_TempDirTestCase):
+
+    def setUp(self):
+        super(ChecksumCacheTest, self).setUp()
+        utils.clear_checksum_cache()
+        self._old_racy_window = utils._RACY_WINDOW
+
+    def tearDown(self):
+        utils._RACY_WINDOW = self._old_racy_window
+        utils.clear_checksum_cache()
+        super(ChecksumCacheTest, self).tearDown()
+
+    def _new_hash_cache(self):
+        hash_cache = utils.FileHashCache(os.path.join(self.tmpdir,
+                                                      'hash.sqlite'),
+                                         backend='sqlite')
+        self.addCleanup(hash_cache.close)
+        return hash_cache
+
+    def test_changed_file_hashed_again(self):
+        fpath = self._write('f', b'a' * 100)
+        self.assertEqual(utils.checksum_file(fpath),
+                         utils.checksum_data(b'a' * 100))
+        self._write('f', b'b' * 200)
+        self.assertEqual(utils.checksum_file(fpath),
+                         utils.checksum_data(b'b' * 200))
+
+    def test_same_size_rewrite(self):
+        fpath = self._write('f', b'a' * 100)
+        self.assertEqual(utils.checksum_file(fpath),
+                         utils.checksum_data(b'a' * 100))
+        fstat = os.stat(fpath)
+
+        # usually within the same timestamp tick, so not even the inode
+        # change time is different from the first version of the file
+        self._write('f', b'b' * 100)
+        # restore the modification time, as 'cp -p' or 'rsync -t' do
+        if hasattr(fstat, 'st_mtime_ns'):
+            os.utime(fpath, ns=(fstat.st_atime_ns, fstat.st_mtime_ns))
+            self.assertEqual(os.stat(fpath).st_mtime_ns, fstat.st_mtime_ns)
+        else:
+            os.utime(fpath, (fstat.st_atime, fstat.st_mtime))
+
+        self.assertEqual(utils.checksum_file(fpath),
+                         utils.checksum_data(b'b' * 100))
+
+    def test_recently_changed_not_cached(self):
+        fpath = self._write('f', b'data')
+        key = utils._checksum_key(os.stat(fpath), 'sha256')
+        hash_cache = self._new_hash_cache()
+        expected = utils.checksum_data(b'data')
+        self.assertEqual(utils.checksum_file(fpath, hash_cache=hash_cache),
+                         expected)
+        self.assertEqual(utils._checksum_cache.get(key), None)
+        self.assertEqual(hash_cache._get(key), None)
+
+        utils._RACY_WINDOW = 0
+        self.assertEqual(utils.checksum_file(fpath, hash_cache=hash_cache),
+                         expected)
+        self.assertEqual(utils._checksum_cache.get(key), expected)
+        self.assertEqual(hash_cache._get(key), expected)
+
+    def test_use_cache_false(self):
+        fpath = self._write('f', b'data')
+        wrong = utils.checksum_data(b'wrong')
+        utils._checksum_cache.put(utils._checksum_key(os.stat(fpath),
+                                                      'sha256'), wrong)
+        # the cached value is used as long as the file has not changed...
+        self.assertEqual(utils.checksum_file(fpath), wrong)
+        # ...unless the file is read explicitly, which replaces it
+        expected = utils.checksum_data(b'data')
+        self.assertEqual(utils.checksum_file(fpath, use_cache=False),
+                         expected)
+        self.assertEqual(utils.checksum_file(fpath), expected)
+
+    def test_persistent_cache(self):
+        fpath = self._write('f', b'data')
+        hash_cache = self._new_hash_cache()
+        fstat = os.stat(fpath)
+        wrong = utils.checksum_data(b'wrong')
+        expected = utils.checksum_data(b'data')
+        for racy_window in (utils._RACY_WINDOW, 0):
+            utils._RACY_WINDOW = racy_window
+            utils.clear_checksum_cache()
+            hash_cache.put(fstat, 'sha256', wrong)
+            self.assertEqual(utils.checksum_file(fpath,
+                                                 hash_cache=hash_cache),
+                             wrong)
+            self.assertEqual(utils.checksum_file(fpath, hash_cache=hash_cache,
+                                                 use_cache=False),
+                             expected)
+            # replaced, or just removed if the file is too recent
+            self.assertEqual(hash_cache.get(fstat, 'sha256'),
+                             expected if racy_window == 0 else None)
+            utils.clear_checksum_cache()
+            self.assertEqual(utils.checksum_file(fpath,
+                                                 hash_cache=hash_cache),
+                             expected)
+
+
+# -----------------------------------------------
+class FileFingerprintTest(_TempDirTestCase):
+
+    def test_fingerprint(self):
+        fpath = self._write('f', b'data' * 1000)
+        fstat = os.stat(fpath)
+        result = utils.file_fingerprint(fpath, 'sha1')
+        self.assertEqual(list(result.keys()),
+                         ['size', 'mtime', 'ctime', 'checksum'])
+        self.assertEqual(result['size'], 4000)
+        self.assertEqual(result['mtime'], fstat.st_mtime)
+        self.assertEqual(result['ctime'], fstat.st_ctime)
+        self.assertEqual(result['checksum'],
+                         utils.checksum_data(b'data' * 1000, 'sha1'))
+        self.assertEqual(result['checksum'], utils.checksum_file(fpath, 'sha1'))
+
+
+# -----------------------------------------------
+class ChecksumFilesBatchTest(_TempDirTestCase):
+
+    def test_same_order_as_paths(self):
+        contents = [('file %d' % i).encode('ascii') * i for i in range(10)]
+        paths = [self._write('f%d' % i, data)
+                 for i, data in enumerate(contents)]
+        expected = [utils.checksum_data(data, 'md5') for data in contents]
+        for lanes in (1, 4):
+            self.assertEqual(utils.checksum_files_batch(paths, 'md5',
+                                                        lanes=lanes),
+                             expected)
+
+    def test_checksum_files_unique_paths(self):
+        paths = [self._write('f%d' % i, b'x' * i) for i in range(5)]
+        hashed = []
+        checksum_file = utils.checksum_file
+        def counting_checksum_file(fpath, *args, **kwargs):
+            hashed.append(fpath)
+            return checksum_file(fpath, *args, **kwargs)
+        utils.checksum_file = counting_checksum_file
+        try:
+            for workers in (1, 3):
+                del hashed[:]
+                result = utils.checksum_files(paths[3:] + paths + paths[:2],
+                                              'md5', workers=workers)
+                self.assertEqual(list(result.keys()),
+                                 paths[3:] + paths[:3])
+                self.assertEqual(sorted(hashed), sorted(paths))
+                for i, fpath in enumerate(paths):
+                    self.assertEqual(result[fpath],
+                                     utils.checksum_data(b'x' * i, 'md5'))
+        finally:
+            utils.checksum_file = checksum_file
+
+    def test_unknown_algorithm(self):
+        fpath = self._write('f', b'data')
+        self.assertRaises(GeneralException, utils.checksum_files_batch,
+                          [fpath, fpath], 'no_such_algorithm')
+
+
+# -----------------------------------------------
+class FindExecutableTest(_TempDirTestCase):
+
+    name = 'pymdeco_test_tool' + ('.exe' if sys.platform == 'win32' else '')
+
+    def setUp(self):
+        super(FindExecutableTest, self).setUp()
+        self.dirs = []
+        for dirname in ('a', 'b'):
+            self.dirs.append(os.path.join(self.tmpdir, dirname))
+            os.mkdir(self.dirs[-1])
+
+    def _make_executable(self, dirname, name=None, mode=0o755):
+        fpath = os.path.join(dirname, name or self.name)
+        with open(fpath, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(fpath, mode)
+        return fpath
+
+    def test_found_in_path(self):
+        expected = self._make_executable(self.dirs[1])
+        self.assertEqual(utils.find_executable(self.name,
+                                               os.pathsep.join(self.dirs)),
+                         expected)
+        self.assertEqual(utils.find_executable(self.name, self.dirs[0]), None)
+
+    def test_result_cached(self):
+        expected = self._make_executable(self.dirs[0])
+        path = os.pathsep.join(self.dirs)
+        self.assertEqual(utils.find_executable(self.name, path), expected)
+        os.remove(expected)
+        self.assertEqual(utils.find_executable(self.name, path), expected)
+
+    def test_not_found_not_cached(self):
+        path = os.pathsep.join(self.dirs)
+        self.assertEqual(utils.find_executable(self.name, path), None)
+        expected = self._make_executable(self.dirs[1])
+        self.assertEqual(utils.find_executable(self.name, path), expected)
+
+    def test_relative_to_current_dir(self):
+        expected = self._make_executable(self.dirs[0])
+        relative = os.path.join('a', self.name)
+        old_cwd = os.getcwd()
+        try:
+            for i in range(2):
+                os.chdir(self.dirs[0])
+                self.assertEqual(os.path.realpath(utils.find_executable(
+                    self.name, os.curdir)), os.path.realpath(expected))
+                self.assertEqual(utils.find_executable(relative, ''), None)
+                os.chdir(self.dirs[1])
+                self.assertEqual(utils.find_executable(self.name, os.curdir),
+                                 None)
+                os.chdir(self.tmpdir)
+                self.assertEqual(os.path.realpath(utils.find_executable(
+                    relative, '')), os.path.realpath(expected))
+        finally:
+            os.chdir(old_cwd)
+
+    @unittest.skipUnless(hasattr(os, 'scandir'), 'os.scandir not available')
+    def test_in_dirs_search_order(self):
+        a, b = self.dirs
+        missing = os.path.join(self.tmpdir, 'missing')
+        extlist = ['.exe', '.bat']
+        tool_bat = self._make_executable(b, 'tool.bat')
+        self._make_executable(b, 'other.exe')
+        # the directories are searched in order, the extensions in each one
+        self.assertEqual(utils._find_executable_in_dirs('tool', [missing, b],
+                                                        extlist),
+                         tool_bat)
+        tool_exe = self._make_executable(a, 'Tool.EXE')
+        self._make_executable(a, 'tool.bat')
+        self.assertEqual(utils._find_executable_in_dirs('tool', [a, b],
+                                                        extlist),
+                         tool_exe)
+        self.assertEqual(utils._find_executable_in_dirs('tool', [b, a],
+                                                        extlist),
+                         tool_bat)
+        self.assertEqual(utils._find_executable_in_dirs('tool', [missing],
+                                                        extlist),
+                         None)
+
+    @unittest.skipUnless(hasattr(os, 'scandir'), 'os.scandir not available')
+    def test_in_many_dirs_search_order(self):
+        # long lists of directories are listed by several threads
+        paths = [os.path.join(self.tmpdir, 'dir%02d' % i) for i in range(20)]
+        for i, dirname in enumerate(paths):
+            if i % 3:
+                os.mkdir(dirname)
+        first = self._make_executable(paths[13], 'tool.exe')
+        self._make_executable(paths[16], 'tool.bat')
+        last = self._make_executable(paths[17], 'tool.exe')
+        extlist = ['.exe', '.bat']
+        self.assertEqual(utils._find_executable_in_dirs('tool', paths,
+                                                        extlist),
+                         first)
+        self.assertEqual(utils._find_executable_in_dirs('tool', paths[::-1],
+                                                        extlist),
+                         last)
+        self.assertEqual(utils._find_executable_in_dirs('tool', paths[:13],
+                                                        extlist),
+                         None)
+
+    @unittest.skipUnless(hasattr(os, 'scandir'), 'os.scandir not available')
+    @unittest.skipIf(sys.platform == 'win32', 'all files are executable')
+    def test_in_dirs_skips_non_executables(self):
+        a, b = self.dirs
+        self._make_executable(a, 'tool.exe', mode=0o644)
+        os.mkdir(os.path.join(a, 'tool.bat'))
+        expected = self._make_executable(b, 'tool.bat')
+        self.assertEqual(utils._find_executable_in_dirs('tool', [a, b],
+                                                        ['.exe', '.bat']),
+                         expected)
+
+
+# -----------------------------------------------
+class GuessMimeTest(unittest.TestCase):
+
+    def _check(self, fname):
+        self.assertEqual(utils.guess_mime_by_ext(fname),
+                         mimetypes.guess_type(fname)[0],
+                         'MIME type mismatch for ' + repr(fname))
+
+    def test_same_as_mimetypes(self):
+        for fname in ('photo.jpg', 'PHOTO.JPG', 'song.mp3', 'clip.avi',
+                      'notes.txt', 'archive.tar.gz', 'archive.tgz',
+                      '/some/path/image.png', '/some.path/no_extension',
+                      '.hidden', 'file.unknown_extension', ''):
+            self._check(fname)
+
+    def test_known_extensions(self):
+        for ext in mimetypes.types_map:
+            self._check('file' + ext)
+            self._check('FILE' + ext.upper())
+            self._check('file' + ext.lower())
+
+    def test_suffixes_and_encodings(self):
+        for ext in list(mimetypes.suffix_map) + \
+                   list(mimetypes.encodings_map):
+            for fname in ('archive' + ext, 'archive.tar' + ext,
+                          'ARCHIVE.TAR' + ext.upper()):
+                self._check(fname)
+        self._check('archive.tar.gz.gz')
+
+    def test_added_types_kept(self):
+        # importing the module does not reload the tables of mimetypes
+        code = ('import mimetypes; '
+                'mimetypes.add_type("application/x-pymdeco-test", ".pmt"); '
+                'from pymdeco import utils; '
+                'print(mimetypes.guess_type("file.pmt")[0]); '
+                'print(utils.guess_mime_by_ext("file.pmt"))')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=root)
+        self.assertEqual(output.decode('ascii').split(),
+                         ['application/x-pymdeco-test'] * 2)
+
+
+# -----------------------------------------------
+class TimestampTest(unittest.TestCase):
+
+    timestamps = (0, 86399, 951782400, 1234567890, 1234567890.75,
+                  2147483653, time.time())
+
+    def test_timestamp_to_datetime(self):
+        for ftimestamp in self.timestamps:
+            self.assertEqual(utils.timestamp_to_datetime(ftimestamp),
+                             datetime.datetime(*time.localtime(ftimestamp)[:6]))
+            self.assertEqual(utils.timestamp_to_datetime(ftimestamp,
+                                                         localtime=False),
+                             datetime.datetime(*time.gmtime(ftimestamp)[:6]))
+
+    def test_format_timestamp(self):
+        self.assertEqual(utils.format_timestamp(1234567890, localtime=False),
+                         '2009-02-13 23:31:30')
+        for ftimestamp in self.timestamps:
+            for localtime in (True, False):
+                dt = utils.timestamp_to_datetime(ftimestamp,
+                                                 localtime=localtime)
+                self.assertEqual(utils.format_timestamp(ftimestamp,
+                                                        localtime=localtime),
+                                 '{0:%Y-%m-%d %H:%M:%S}'.format(dt))
+
+
+# -----------------------------------------------
+class TreeDictTest(unittest.TestCase):
+
+    def _random_items(self, rnd, count):
+        # short keys from a small alphabet, so the same branches are shared
+        # and leaves often replace (or are replaced by) whole branches
+        items = []
+        for i in range(count):
+            depth = rnd.randint(1, 4)
+            key = u'.'.join(rnd.choice(u'abc') for _ in range(depth))
+            items.append((key, i))
+        return items
+
+    def test_add_nodes_same_as_add_node(self):
+        rnd = random.Random(20121024)
+        for _ in range(500):
+            items = self._random_items(rnd, rnd.randint(1, 30))
+            expected = utils.TreeDict()
+            for key, val in items:
+                expected.add_node(key, val)
+            result = utils.TreeDict()
+            result.add_nodes(items)
+            self.assertEqual(result, expected)
+            self.assertEqual(result.to_json(), expected.to_json())
+
+    def test_add_nodes_with_separator(self):
+        expected = utils.TreeDict()
+        expected.add_node(u'a/b/c', 1, sep=u'/')
+        expected.add_node(u'a/b/d', 2, sep=u'/')
+        result = utils.TreeDict()
+        result.add_nodes([(u'a/b/c', 1), (u'a/b/d', 2)], sep=u'/')
+        self.assertEqual(result, expected)
+
+    @unittest.skipIf(sys.version_info < (3, 7),
+                     'the branches are dictionaries without order')
+    def test_to_flatten_order(self):
+        # the leaves are in the depth-first order of the tree
+        tree = utils.TreeDict()
+        tree.add_nodes([(u'a.b.c', 3), (u'answer.42', None),
+                        (u'answer.to.everything', 42)])
+        self.assertEqual(list(tree.to_flatten().items()),
+                         [(u'a.b.c', 3), (u'answer.42', None),
+                          (u'answer.to.everything', 42)])
+        tree = utils.TreeDict()
+        tree.add_nodes([(u'z.y', 1), (u'a', 2), (u'z.b', 3)])
+        self.assertEqual(list(tree.to_flatten(sep=u'/').items()),
+                         [(u'z/y', 1), (u'z/b', 3), (u'a', 2)])
+
+    def test_flatten_tree_dict(self):
+        tree = {u'a': {u'b': 1, 2: {u'c': None}}, 3.5: u'x'}
+        self.assertEqual(dict(utils.flatten_tree_dict(tree)),
+                         {u'a.b': 1, u'a.2.c': None, u'3.5': u'x'})
+        self.assertEqual(dict(utils.flatten_tree_dict(tree, sep=u'/')),
+                         {u'a/b': 1, u'a/2/c': None, u'3.5': u'x'})
+
+
+# -----------------------------------------------
+class EnhancedDictTest(unittest.TestCase):
+
+    def _sample(self):
+        value = utils.EnhancedDict()
+        value[u'name'] = u'f\xfcr \u65e5\u672c'
+        value[u'size'] = 12
+        value[u'big'] = 2 ** 70
+        value[u'ratio'] = 0.1
+        value[u'flags'] = [True, False, None, 1.5, []]
+        value[u'empty'] = {}
+        value[u'nested'] = utils.EnhancedDict([(u'z', 1), (u'a', {u'b': 2})])
+        return value
+
+    def _check_same_as_json_dumps(self, value, **kwargs):
+        self.assertEqual(value.to_json(**kwargs), json.dumps(value, **kwargs))
+
+    def _check_all(self):
+        for kwargs in ({}, {'indent': 2, 'ensure_ascii': False},
+                       {'indent': 2, 'ensure_ascii': False, 'sort_keys': True},
+                       {'indent': 4, 'ensure_ascii': False},
+                       {'indent': 2}):
+            self._check_same_as_json_dumps(self._sample(), **kwargs)
+            numeric_keys = utils.EnhancedDict([(2, u'b'), (1, u'a')])
+            self._check_same_as_json_dumps(numeric_keys, **kwargs)
+            with_date = utils.EnhancedDict(date=datetime.datetime(2012, 1, 1))
+            self.assertRaises(TypeError, with_date.to_json, **kwargs)
+
+    def test_same_as_json_dumps(self):
+        self._check_all()
+
+    def test_without_orjson(self):
+        old_orjson = utils.orjson
+        utils.orjson = None
+        try:
+            self._check_all()
+        finally:
+            utils.orjson = old_orjson
+
+
+# -----------------------------------------------
+class IterFilesTest(_TempDirTestCase):
+
+    def setUp(self):
+        super(IterFilesTest, self).setUp()
+        for dirname in ('d1', os.path.join('d1', 'd2'), 'd3'):
+            os.mkdir(os.path.join(self.tmpdir, dirname))
+            for i in range(3):
+                self._write(os.path.join(dirname, 'f%d' % i), b'x' * i)
+        self._write('top', b'top')
+        if hasattr(os, 'symlink'):
+            os.symlink(os.path.join(self.tmpdir, 'missing'),
+                       os.path.join(self.tmpdir, 'broken_link'))
+
+    def _check_same_as_os_walk(self):
+        expected = []
+        for root, dirs, files in os.walk(self.tmpdir):
+            for fname in files:
+                expected.append(os.path.join(root, fname))
+        items = list(metadump._iter_files(self.tmpdir))
+        self.assertEqual([fpath for fpath, fstat in items], expected)
+        for fpath, fstat in items:
+            if os.path.exists(fpath):
+                self.assertEqual(fstat.st_size, os.stat(fpath).st_size)
+            else:
+                self.assertEqual(fstat, None)
+
+    def test_same_as_os_walk(self):
+        self._check_same_as_os_walk()
+
+    def test_without_scandir(self):
+        old_scandir = metadump.scandir
+        metadump.scandir = None
+        try:
+            self._check_same_as_os_walk()
+        finally:
+            metadump.scandir = old_scandir
+
+
+# -----------------------------------------------
+def _forks_workers():
+    # the scan service set up by the tests is inherited only by forked
+    # worker processes
+    get_start_method = getattr(multiprocessing, 'get_start_method', None)
+    if get_start_method is None:
+        return os.name == 'posix' # Python 2.x
+    return get_start_method() == 'fork'
+
+
+class MetadumpTest(_TempDirTestCase):
+
+    def setUp(self):
+        super(MetadumpTest, self).setUp()
+        for i in range(40):
+            self._write('file%02d.txt' % i, b'x' * i)
+        os.mkdir(os.path.join(self.tmpdir, 'subdir'))
+        self._write(os.path.join('subdir', 'image.jpg'), b'not an image')
+        # only the scanner without external dependencies
+        self._old_scan_service = metadump._scan_service
+        metadump._scan_service = FileMetadataService(
+            scanners_list=[FileInfoScanner()])
+
+    def tearDown(self):
+        metadump._scan_service = self._old_scan_service
+        super(MetadumpTest, self).tearDown()
+
+    def _run(self, *args):
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            metadump.main(['-p', self.tmpdir, '--no-cache'] + list(args))
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+
+    @unittest.skipUnless(_forks_workers(), 'worker processes are not forked')
+    def test_parallel_same_as_serial(self):
+        # the first read of each file may still update its access time
+        self._run('-j', '1')
+        serial = self._run('-j', '1')
+        self.assertEqual(serial.count('processing file:'), 41)
+        self.assertEqual(self._run('-j', '3'), serial)
+
+    def test_without_scandir_and_futures(self):
+        self._run('-j', '1')
+        expected = self._run('-j', '1')
+        old_scandir, old_futures = metadump.scandir, metadump.futures
+        metadump.scandir = metadump.futures = None
+        try:
+            self.assertEqual(self._run('-j', '3'), expected)
+        finally:
+            metadump.scandir, metadump.futures = old_scandir, old_futures
+
+
+# -----------------------------------------------
+class ScannerRegisterTest(unittest.TestCase):
+
+    def test_own_bound_method(self):
+        scanner = Scanner()
+        scanner._register(scanner.pre_checks, 'pre checks')
+        self.assertEqual(scanner._methods,
+                         [(scanner.pre_checks, 'pre checks')])
+        self.assertEqual(len(FileInfoScanner()._methods), 6)
+
+    def test_foreign_callables_rejected(self):
+        scanner = Scanner()
+        for meth in (Scanner().pre_checks, Scanner.pre_checks, len,
+                     lambda fpath: {}, 'not callable'):
+            self.assertRaises(GeneralException, scanner._register, meth)
+        self.assertEqual(scanner._methods, [])
+
+
+# -----------------------------------------------
+class _UpperCaseMimeScanner(FileInfoScanner):
+
+    def _add_mime(self, fpath):
+        result = super(_UpperCaseMimeScanner, self)._add_mime(fpath)
+        result['mime_type'] = result['mime_type'].upper()
+        return result
+
+
+class FastScanTest(_TempDirTestCase):
+
+    def _check_same_as_scan(self, scanner):
+        scanner.pre_checks()
+        for name, data in (('notes.txt', b'some text'),
+                           ('image.JPG', b'not an image'),
+                           ('no_extension', b''),
+                           ('archive.tar.gz', b'x' * 100000)):
+            fpath = self._write(name, data)
+            result = scanner.fast_scan(fpath)
+            self.assertEqual(result, scanner.scan(fpath))
+            self.assertEqual(result.to_json(), scanner.scan(fpath).to_json())
+            self.assertEqual(scanner.fast_scan(fpath,
+                                               pre_stat=os.stat(fpath)),
+                             result)
+
+    def test_same_as_scan(self):
+        self._check_same_as_scan(FileInfoScanner())
+
+    def test_overridden_method(self):
+        self._check_same_as_scan(_UpperCaseMimeScanner())
+        scanner = _UpperCaseMimeScanner()
+        scanner.pre_checks()
+        self.assertEqual(scanner.fast_scan(self._write('f.txt', b''))
+                         ['mime_type'], 'TEXT/PLAIN')
+
+    def test_utc_timestamps(self):
+        scanner = FileInfoScanner()
+        scanner.pre_checks()
+        fpath = self._write('f', b'data')
+        fstat = os.stat(fpath)
+        self.assertEqual(scanner.fast_scan(fpath, localtime=False)
+                         ['file_timestamps'],
+                         {'modified': utils.format_timestamp(
+                              fstat.st_mtime, localtime=False),
+                          'created': utils.format_timestamp(
+                              fstat.st_ctime, localtime=False)})
+
+
+class _HashCacheTests(object):
+    """
+    Tests for :class:`utils.FileHashCache` with the database type *backend*.
+    """
+
+    backend = None
+
+    def setUp(self):
+        if self.backend == 'lmdb' and utils.lmdb is None:
+            self.skipTest('lmdb library not installed')
+        super(_HashCacheTests, self).setUp()
+        self.fstat = os.stat(self._write('f', b'data'))
+        self.checksum = utils.checksum_data(b'data', 'md5')
+
+    def _new_cache(self):
+        path = os.path.join(self.tmpdir, 'cache', 'hash.' + self.backend)
+        hash_cache = utils.FileHashCache(path, backend=self.backend)
+        self.addCleanup(hash_cache.close)
+        return hash_cache
+
+    def test_put_get(self):
+        hash_cache = self._new_cache()
+        self.assertEqual(hash_cache.get(self.fstat, 'md5'), None)
+        hash_cache.put(self.fstat, 'md5', self.checksum)
+        self.assertEqual(hash_cache.get(self.fstat, 'md5'), self.checksum)
+        self.assertEqual(hash_cache.get(self.fstat, 'sha1'), None)
+
+    def test_other_thread(self):
+        hash_cache = self._new_cache()
+        hash_cache.put(self.fstat, 'md5', self.checksum)
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(hash_cache.get(self.fstat, 'md5')))
+        thread.start()
+        thread.join()
+        self.assertEqual(result, [self.checksum])
+
+    def test_close(self):
+        hash_cache = self._new_cache()
+        thread = threading.Thread(
+            target=lambda: hash_cache.put(self.fstat, 'md5', self.checksum))
+        thread.start()
+        thread.join()
+        hash_cache.close()
+        # opened again when needed
+        self.assertEqual(hash_cache.get(self.fstat, 'md5'), self.checksum)
+        hash_cache.close()
+        hash_cache.close()
+
+    def test_second_instance(self):
+        hash_cache = self._new_cache()
+        hash_cache.put(self.fstat, 'md5', self.checksum)
+        other = self._new_cache()
+        self.assertEqual(other.get(self.fstat, 'md5'), self.checksum)
+        other.put(self.fstat, 'sha1', self.checksum)
+        self.assertEqual(hash_cache.get(self.fstat, 'sha1'), self.checksum)
+
+
+class LMDBHashCacheTest(_HashCacheTests, _TempDirTestCase):
+
+    backend = 'lmdb'
+
+
+class SqliteHashCacheTest(_HashCacheTests, _TempDirTestCase):
+
+    backend = 'sqlite'
+
+    def test_unknown_backend(self):
+        self.assertRaises(GeneralException, utils.FileHashCache,
+                          os.path.join(self.tmpdir, 'hash'), 'no_such_backend')
+
+
+# -----------------------------------------------
+class GetAsNumberTest(unittest.TestCase):
+
+    def test_numbers_unchanged(self):
+        for arg in (5, 2.5, fractions.Fraction(1, 3)):
+            self.assertTrue(utils.get_as_number_if_possible(arg) is arg)
+
+    def test_converted(self):
+        for arg, expected in (('42', 42), ('007', 7), ('1.5', 1.5),
+                              ('.5', 0.5), ('5.', 5.0), ('-1.5', -1.5),
+                              (' 3.25 ', 3.25), ('2e10', 2e10),
+                              ('1.5E-3', 1.5e-3)):
+            result = utils.get_as_number_if_possible(arg)
+            self.assertEqual(result, expected)
+            self.assertEqual(type(result), type(expected))
+
+    def test_not_converted(self):
+        for arg in ('-42', 'abc', '1.2.3', 'e', '1e', 'inf', 'nan', '', None,
+                    '0x1f'):
+            self.assertEqual(utils.get_as_number_if_possible(arg), arg)
+
+
+# -----------------------------------------------
+class CheckDependenciesTest(unittest.TestCase):
+
+    def test_optional_dependencies(self):
+        result = utils.check_dependencies()
+        self.assertEqual(sorted(result),
+                         sorted(['pyexiv2', 'blake3', 'pycrc32', 'lmdb',
+                                 'orjson', 'pymdeco._tree', 'ffprobe']))
+        for name, module in (('blake3', utils.blake3),
+                             ('pycrc32', utils.pycrc32),
+                             ('lmdb', utils.lmdb),
+                             ('orjson', utils.orjson)):
+            self.assertEqual(result[name] is None, module is None, name)
+
+
+if __name__ == '__main__':
+    unittest.main()